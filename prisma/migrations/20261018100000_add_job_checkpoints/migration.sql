@@ -0,0 +1,14 @@
+-- CreateTable
+CREATE TABLE "job_checkpoints" (
+    "id" SERIAL NOT NULL,
+    "file" TEXT NOT NULL,
+    "stage" TEXT NOT NULL,
+    "page" INTEGER NOT NULL DEFAULT 0,
+    "data" JSONB,
+    "createdAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT "job_checkpoints_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE UNIQUE INDEX "job_checkpoints_file_stage_page_key" ON "job_checkpoints"("file", "stage", "page");
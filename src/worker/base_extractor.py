@@ -1,8 +1,45 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict
+from contextlib import contextmanager
+from typing import List, Dict, Iterator
+
+from document_context import DocumentContext
 
 class BaseExtractor(ABC):
 
     @abstractmethod
-    def extract(self, pdf_path: str) -> list[dict]:
-        pass
\ No newline at end of file
+    def extract_page(self, doc: DocumentContext, page_number: int) -> list[dict]:
+        """Extract the objects of one page (1-based) of an open document."""
+        pass
+
+    def extract_iter(self, source: DocumentContext | str) -> Iterator[tuple[int, list[dict]]]:
+        """
+        Yield (page number, objects) for every page of an open DocumentContext
+        (or a PDF path, opened just for this iteration), one page at a time.
+        Pages of a document opened here are released once they are yielded, and
+        DocumentContext only loads a page when it is reached, so memory stays
+        bounded by a page rather than growing with the document.
+        """
+        with self.open_document(source) as doc:
+            yield from self._iter_open(doc, owned=doc is not source)
+
+    def _iter_open(self, doc: DocumentContext, owned: bool) -> Iterator[tuple[int, list[dict]]]:
+        for page in doc:
+            objects = self.extract_page(doc, page.number)
+            if owned:
+                page.release()
+            yield page.number, objects
+
+    def extract(self, source: DocumentContext | str) -> list[dict]:
+        """Extract objects from every page of an open DocumentContext (or a PDF path, opened just for this call)."""
+        return [obj for _, objects in self.extract_iter(source) for obj in objects]
+
+    @contextmanager
+    def open_document(self, source: DocumentContext | str) -> Iterator[DocumentContext]:
+        if isinstance(source, DocumentContext):
+            yield source
+            return
+        doc = DocumentContext(source)
+        try:
+            yield doc
+        finally:
+            doc.close()
@@ -0,0 +1,40 @@
+import json
+
+
+class CheckpointStore:
+    """
+    Progress markers of a job in the job_checkpoints table, so a retried job can
+    skip the work an earlier attempt already finished.
+
+    Stages:
+      download     (page 0) content hash and page count of the downloaded PDF
+      extract      (page n) text/image/table objects of page n, after the upload
+      page         (page n) components of page n are stored in pdf_objects
+      embeddings   (page 0) the Chroma collection was built
+
+    save() does not commit: callers commit a checkpoint in the same transaction
+    as the rows it vouches for, so both are there or neither is.
+    """
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def load(self, file: str) -> dict:
+        """All checkpoints of a file as {(stage, page): data}."""
+        self.cursor.execute(
+            "SELECT stage, page, data FROM job_checkpoints WHERE file = %s",
+            (file,)
+        )
+        return {(stage, page): data for stage, page, data in self.cursor.fetchall()}
+
+    def save(self, file: str, stage: str, page: int = 0, data=None):
+        self.cursor.execute(
+            """
+            INSERT INTO job_checkpoints (file, stage, page, data)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (file, stage, page) DO UPDATE SET data = EXCLUDED.data
+            """,
+            (file, stage, page, json.dumps(data) if data is not None else None)
+        )
+
+    def clear(self, file: str):
+        self.cursor.execute("DELETE FROM job_checkpoints WHERE file = %s", (file,))
@@ -0,0 +1,131 @@
+import os
+from collections import OrderedDict
+
+import fitz  # PyMuPDF
+import numpy as np
+
+# Rasters are large (~25 MB per page at 300 dpi), so only the most recent pages are kept
+RASTER_CACHE_PAGES = 2
+
+
+class PageContext:
+    """
+    One page of an open document. Every piece of page data is computed on first
+    use and then shared by all extractors, so the page is parsed only once.
+    """
+    def __init__(self, document: "DocumentContext", number: int, page: fitz.Page):
+        self.document = document
+        self.number = number  # 1-based
+        self.page = page
+        self.rect = page.rect
+        self.width = page.rect.width
+        self.height = page.rect.height
+        self._text_dict = None
+        self._images = None
+        self._image_placements = None
+
+    @property
+    def text_dict(self) -> dict:
+        """page.get_text("dict") without the embedded image blocks (TextExtractor skips them anyway)."""
+        if self._text_dict is None:
+            flags = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+            self._text_dict = self.page.get_text("dict", flags=flags)
+        return self._text_dict
+
+    @property
+    def images(self) -> list:
+        """page.get_images(full=True)"""
+        if self._images is None:
+            self._images = self.page.get_images(full=True)
+        return self._images
+
+    def image_placements(self, xref: int) -> list[dict]:
+        """Placements of one image on the page, like page.get_image_info(xref) but computed once per page."""
+        if self._image_placements is None:
+            self._image_placements = {}
+            for info in self.page.get_image_info(xrefs=True):
+                self._image_placements.setdefault(info["xref"], []).append(info)
+        return self._image_placements.get(xref, [])
+
+    def raster(self, dpi: int = 300) -> fitz.Pixmap:
+        return self.document._raster(self, dpi)
+
+    def raster_array(self, dpi: int = 300) -> np.ndarray:
+        """Raster as an (h, w, 3) BGR array, the layout the detectron/OCR models expect."""
+        pix = self.raster(dpi)
+        return np.frombuffer(pix.samples, np.uint8).reshape(pix.h, pix.w, 3)[..., ::-1]
+
+    def release(self):
+        """Drop the cached data of this page, and the document's hold on it, once nothing needs it anymore."""
+        self._text_dict = None
+        self._images = None
+        self._image_placements = None
+        self.document._drop_page(self.number)
+
+
+class DocumentContext:
+    """
+    Per-job handle on a PDF: opened once with fitz and shared by all extractors.
+    Pages are walked once when the context is created (for page sizes only), and
+    a page's PageContext, caching its text blocks, image references and rasters,
+    is loaded on first use and kept until it is released.
+    """
+    def __init__(self, pdf_path: str):
+        self.path = pdf_path
+        self.name = os.path.splitext(os.path.basename(pdf_path))[0]
+        self.doc = fitz.open(pdf_path)
+        self._dims = {number: (page.rect.width, page.rect.height) for number, page in enumerate(self.doc, 1)}
+        self._pages = {}
+        self._rasters = OrderedDict()
+        self._state = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self._dims)
+
+    def __iter__(self):
+        return (self.page(number) for number in range(1, len(self) + 1))
+
+    def page(self, number: int) -> PageContext:
+        """1-based page lookup, loading the page if it is not held yet"""
+        if not 1 <= number <= len(self):
+            raise IndexError(f"page {number} out of range")
+        page = self._pages.get(number)
+        if page is None:
+            page = self._pages[number] = PageContext(self, number, self.doc[number - 1])
+        return page
+
+    def state(self, owner) -> dict:
+        """Per-document scratch space of an extractor (output dirs, dedupe hashes, ...)."""
+        return self._state.setdefault(type(owner).__name__, {})
+
+    @property
+    def page_dims(self) -> dict:
+        return dict(self._dims)
+
+    def _raster(self, page: PageContext, dpi: int) -> fitz.Pixmap:
+        key = (page.number, dpi)
+        if key in self._rasters:
+            self._rasters.move_to_end(key)
+            return self._rasters[key]
+        pix = page.page.get_pixmap(dpi=dpi, alpha=False)
+        self._rasters[key] = pix
+        while len({number for number, _ in self._rasters}) > RASTER_CACHE_PAGES:
+            self._rasters.popitem(last=False)
+        return pix
+
+    def _drop_page(self, page_number: int):
+        self._pages.pop(page_number, None)
+        for key in [k for k in self._rasters if k[0] == page_number]:
+            del self._rasters[key]
+
+    def close(self):
+        self._rasters.clear()
+        self._state.clear()
+        self._pages.clear()
+        self.doc.close()
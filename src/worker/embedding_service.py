@@ -363,6 +363,35 @@ class EmbeddingService:
             'document_structure': document_structure
         }
     
+    def clone_embeddings(self, source_file: str, target_file: str) -> int | None:
+        """
+        Copy the embedding collection of an already processed file to a new file name.
+        Returns the number of copied chunks, or None if the source has no collection.
+        """
+        try:
+            source = self.chroma_client.get_collection(sanitize_collection_name(source_file))
+        except Exception:
+            return None
+
+        target_name = sanitize_collection_name(target_file)
+        try:
+            self.chroma_client.delete_collection(target_name)
+        except Exception:
+            pass
+        target = self.chroma_client.create_collection(target_name)
+
+        data = source.get(include=["embeddings", "documents", "metadatas"])
+        if not data['ids']:
+            return 0
+        metadatas = [{**metadata, 'file_name': target_file} for metadata in data['metadatas']]
+        target.add(
+            embeddings=data['embeddings'],
+            documents=data['documents'],
+            metadatas=metadatas,
+            ids=data['ids']
+        )
+        return len(data['ids'])
+
     def search_similar(self, file_name: str, query: str, n_results: int = 5) -> List[Dict[str, Any]]:
         """
         Search for semantically similar chunks in a document.
@@ -0,0 +1,245 @@
+import re
+
+from label_protocol import split_sentences, object_component
+
+PAGE_NUMBER_RE = re.compile(r"^(?:page\s+)?\d{1,4}(?:\s*(?:/|of)\s*\d{1,4})?$", re.IGNORECASE)
+# "3.1 Method", "2 Related Work": a short section number and a capitalized title without sentence punctuation
+HEADING_RE = re.compile(r"^(\d{1,2}(?:\.\d{1,2}){0,4})\.?\s+([A-Z][^.!?:;=]{1,80})$")
+HEADING_MAX_WORDS = 12
+# Unnumbered section titles that need no context to recognize
+SECTION_NAMES = {"references", "bibliography", "acknowledgments", "acknowledgements", "acknowledgment", "acknowledgement"}
+CAPTION_RE = re.compile(r"^(Figure|Fig\.|Table)\s*(\d+)\s*[.:]\s*(.*)$", re.IGNORECASE)
+REFERENCE_RE = re.compile(r"^\[\d{1,3}\]\s+\S")
+REFERENCE_SPLIT_RE = re.compile(r"\s(?=\[\d{1,3}\]\s)")
+# "Vaswani, A., ..." or "A. Vaswani, ..." followed somewhere by a year
+AUTHOR_LIST_RE = re.compile(r"^(?:[A-Z][A-Za-z'\-]+,\s+[A-Z]\.|[A-Z]\.\s*(?:[A-Z]\.\s*)?[A-Z][A-Za-z'\-]+,)")
+YEAR_RE = re.compile(r"\b(?:19|20)\d{2}[a-z]?\b")
+# One author name, "Vaswani, A." or "A. Vaswani"
+AUTHOR_NAME_RE = re.compile(r"[A-Z][A-Za-z'\-]+,\s+(?:[A-Z]\.\s*)+|(?:[A-Z]\.\s*)+[A-Z][A-Za-z'\-]+")
+# Parts of a reference entry: names, title, venue, pages, year
+REFERENCE_PART_SPLIT_RE = re.compile(r"[,;]|\.\s")
+REFERENCE_PART_MAX_WORDS = 8
+# Anything the LLM would have to rewrite as LaTeX
+MATH_RE = re.compile(r"[=^_\\{}<>$∑∏∫√±×÷≤≥≈≠∈∉⊂⊆∀∃∂∇∞→←↦αβγδεζηθικλμνξπρστυφχψωΓΔΘΛΞΠΣΦΨΩ]")
+LIST_MARKER_RE = re.compile(r"^(?:[•●▪◦\-–*]|\(?[a-z0-9]{1,2}[.)])\s")
+
+PROSE_MIN_CHARS = 80
+PROSE_MIN_SENTENCE_CHARS = 20
+# Blocks this close to the top or bottom edge (fraction of the page) may be running headers or footnotes
+EDGE_BAND = 0.08
+
+# Typography from TextExtractor (block["font"]), font sizes relative to the body text
+HEADING_MIN_RATIO = 1.15  # an unnumbered heading is bold or at least this much larger than the body
+LARGE_HEADING_RATIO = 1.3  # unnumbered headings this large are top-level sections
+TITLE_MIN_RATIO = 1.6  # the paper title, on the upper half of the first page
+TITLE_MAX_WORDS = 30
+BODY_MAX_RATIO = 1.1  # plain paragraphs are set in body size
+# Bold body-size lines are headings only with at least this much space above (times the line height)
+HEADING_MIN_GAP = 0.5
+# Bold run-in labels of theorem-like environments and algorithms, not section headings
+ENVIRONMENT_RE = re.compile(
+    r"^(?:theorem|lemma|proof|algorithm|definition|corollary|proposition|remark|example|assumption|claim)\b",
+    re.IGNORECASE,
+)
+
+
+def _heading(number: str, text: str) -> dict:
+    return {
+        "component": "Heading",
+        "props": {"text": text.strip(), "level": min(6, number.count(".") + 2), "sectionNumber": number},
+    }
+
+
+def _caption(kind: str, number: str, text: str) -> list[dict]:
+    comp_type = "table" if kind.lower().startswith("tab") else "figure"
+    sentences = split_sentences(text)
+    label = f"{kind} {number}:"
+    components = [{
+        "component": "FigureTitle",
+        "props": {"text": f"{label} {sentences[0]}" if sentences else label, "figureNumber": number, "type": comp_type},
+    }]
+    if len(sentences) > 1:
+        components.append({
+            "component": "FigureCaption",
+            "props": {"text": " ".join(sentences[1:]), "figureNumber": number, "type": comp_type},
+        })
+    return components
+
+
+def _is_reference(flat: str) -> bool:
+    if REFERENCE_RE.match(flat):
+        return True
+    if not (AUTHOR_LIST_RE.match(flat) and YEAR_RE.search(flat) and flat.count(",") >= 2):
+        return False
+    # Prose that happens to start with a name ("Smith, J., as shown in prior work, found that ...")
+    # has a single author and runs on in long clauses
+    if len(AUTHOR_NAME_RE.findall(flat)) < 2 and "et al" not in flat:
+        return False
+    return all(len(part.split()) <= REFERENCE_PART_MAX_WORDS for part in REFERENCE_PART_SPLIT_RE.split(flat))
+
+
+def _font(chunk: dict) -> dict | None:
+    """Typography of a block, None when the extractor did not record it."""
+    font = chunk.get("font")
+    return font if font and font.get("ratio") else None
+
+
+def _emphasized(font: dict, min_ratio: float) -> bool:
+    return font["bold"] or font["ratio"] >= min_ratio
+
+
+def _title(chunk: dict, flat: str, page_size: tuple = None) -> bool:
+    font = _font(chunk)
+    if not font or chunk.get("page", 1) != 1 or font["ratio"] < TITLE_MIN_RATIO:
+        return False
+    bbox = chunk.get("bbox")
+    if not bbox or not page_size or bbox[1] / page_size[1] > 0.5:
+        return False
+    return len(flat.split()) <= TITLE_MAX_WORDS and flat[-1] not in ".:;," and not MATH_RE.search(flat)
+
+
+def stands_alone(chunk: dict, page_blocks: list[dict]) -> bool:
+    """
+    Whether a block has its column to itself on its row, with space above it:
+    a heading between paragraphs rather than a table cell or a line in a run of short lines.
+    """
+    bbox = chunk.get("bbox")
+    if not bbox:
+        return False
+    height = bbox[3] - bbox[1]
+    column = chunk.get("column")
+    gap_above = None
+    for other in page_blocks:
+        obox = other.get("bbox")
+        if other is chunk or not obox or other.get("page") != chunk.get("page"):
+            continue
+        other_column = other.get("column")
+        if column is not None and other_column is not None and other_column != column:
+            continue
+        overlap = min(bbox[3], obox[3]) - max(bbox[1], obox[1])
+        if overlap > 0.5 * min(height, obox[3] - obox[1]):
+            return False  # another block on the same row: a table or a multi-part line
+        if obox[3] <= bbox[1] + 0.5 * height:
+            gap = bbox[1] - obox[3]
+            gap_above = gap if gap_above is None else min(gap_above, gap)
+    return gap_above is None or gap_above >= HEADING_MIN_GAP * height
+
+
+def _unnumbered_heading(chunk: dict, flat: str, page_blocks: list[dict] = None) -> dict | None:
+    """
+    A short line after the first page (whose bold lines are author names and
+    the like) set larger than the body, or bold and on its own between paragraphs.
+    """
+    font = _font(chunk)
+    if not font or chunk.get("page", 1) <= 1:
+        return None
+    if font["ratio"] < HEADING_MIN_RATIO and not (font["bold"] and page_blocks and stands_alone(chunk, page_blocks)):
+        return None
+    if len(flat.split()) > HEADING_MAX_WORDS or not flat[0].isupper() or flat[-1] in ".!?;," or ":" in flat:
+        return None
+    if MATH_RE.search(flat) or LIST_MARKER_RE.match(flat) or YEAR_RE.search(flat) or ENVIRONMENT_RE.match(flat):
+        return None
+    return {"component": "Heading", "props": {"text": flat, "level": 2 if font["ratio"] >= LARGE_HEADING_RATIO else 3}}
+
+
+def _near_edge(chunk: dict, page_size: tuple = None) -> bool:
+    bbox = chunk.get("bbox")
+    if not bbox or not page_size:
+        return False
+    height = page_size[1]
+    return bbox[1] / height < EDGE_BAND or bbox[3] / height > 1 - EDGE_BAND
+
+
+def _prose_sentences(chunk: dict, flat: str, page_size: tuple = None) -> list[str] | None:
+    """Sentences of a plain body paragraph, None if the block might be anything else."""
+    # The first page holds the title, authors and abstract, which need the LLM
+    if chunk.get("page", 1) <= 1 or _near_edge(chunk, page_size):
+        return None
+    if len(flat) < PROSE_MIN_CHARS or not flat[0].isupper() or flat[-1] not in ".!?":
+        return None
+    if MATH_RE.search(flat) or LIST_MARKER_RE.match(flat) or flat.lower().startswith("abstract"):
+        return None
+    font = _font(chunk)
+    if font and (font["bold"] or font["ratio"] > BODY_MAX_RATIO):
+        return None
+    sentences = split_sentences(flat)
+    if any(len(s) < PROSE_MIN_SENTENCE_CHARS for s in sentences):
+        return None
+    return sentences
+
+
+def classify_block(chunk: dict, page_size: tuple = None, page_blocks: list[dict] = None) -> list[dict] | None:
+    """
+    Components for a text block whose role is clear without the LLM: page
+    numbers (dropped), numbered and well-known section headings, figure/table
+    captions, reference list entries and plain body paragraphs, and, from
+    the block's typography, the title and unnumbered headings (page_blocks,
+    the other blocks of the page, tell whether a bold line stands alone).
+    Returns None when the block is ambiguous and has to go to the LLM.
+    """
+    text = chunk.get("content", "").strip()
+    flat = " ".join(text.split())
+    if not flat:
+        return []
+    if PAGE_NUMBER_RE.match(flat):
+        return []
+
+    # Sentences with math need the LLM's LaTeX, whatever else they look like
+    has_math = bool(MATH_RE.search(flat))
+    match = CAPTION_RE.match(flat)
+    if match and not has_math:
+        return _caption(match.group(1), match.group(2), match.group(3))
+
+    if not has_math and _is_reference(flat):
+        return [
+            {"component": "Text", "props": {"text": entry, "style": "paragraph"}}
+            for entry in REFERENCE_SPLIT_RE.split(flat)
+        ]
+
+    if _title(chunk, flat, page_size):
+        return [{"component": "Title", "props": {"text": flat}}]
+
+    if "\n" not in text:
+        font = _font(chunk)
+        match = HEADING_RE.match(flat)
+        # A numbered line set like body text is more likely a list item than a section heading
+        if match and len(flat.split()) <= HEADING_MAX_WORDS and not MATH_RE.search(flat) and (
+                font is None or _emphasized(font, BODY_MAX_RATIO)):
+            return [_heading(match.group(1), match.group(2))]
+        if flat.lower().rstrip(":") in SECTION_NAMES:
+            return [{"component": "Heading", "props": {"text": flat.rstrip(":"), "level": 2}}]
+        heading = _unnumbered_heading(chunk, flat, page_blocks)
+        if heading:
+            return [heading]
+
+    sentences = _prose_sentences(chunk, flat, page_size)
+    if sentences:
+        return [{"component": "Text", "props": {"text": s, "style": "sentence"}} for s in sentences]
+    return None
+
+
+def place_objects(blocks: list[tuple], images: list[dict], tables: list[dict], page_size: tuple = None) -> list[dict]:
+    """
+    Components of a page resolved entirely by the fast path, given as (chunk,
+    components) pairs, with every image and table inserted before the first
+    block that starts below it.
+    """
+    objects = [(obj, "Image") for obj in images or []] + [(obj, "Table") for obj in tables or []]
+    placed = [[] for _ in range(len(blocks) + 1)]
+    for obj, kind in objects:
+        position = len(blocks)
+        pos = obj.get("relative_position")
+        if pos and page_size:
+            for i, (chunk, _) in enumerate(blocks):
+                bbox = chunk.get("bbox")
+                if bbox and bbox[1] / page_size[1] > pos["y"]:
+                    position = i
+                    break
+        placed[position].append(object_component(obj, kind))
+
+    components = []
+    for (_, block_components), before in zip(blocks, placed):
+        components.extend(before)
+        components.extend(block_components)
+    components.extend(placed[-1])
+    return components
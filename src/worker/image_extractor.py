@@ -1,101 +1,140 @@
 import fitz
 import os
 import hashlib
-import tempfile
 from base_extractor import BaseExtractor
+from document_context import DocumentContext
 from PIL import Image
 import io
 import shutil
-from collections import defaultdict
+import re
+
+# The /Length entry of a stream dictionary, direct or an indirect reference
+_LENGTH_RE = re.compile(r"/Length\s+\d+(?:\s+\d+\s+R)?")
 
 class ImageExtractor(BaseExtractor):
-    def extract(self, pdf_path: str) -> list[dict]:
-        extracted = []
-        doc = fitz.open(pdf_path)
-        
-        # Create directory for extracted images
-        pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
-        images_dir = os.path.join("extracted_images", pdf_name)
-        os.makedirs(images_dir, exist_ok=True)
+    def _document_state(self, doc: DocumentContext) -> dict:
+        state = doc.state(self)
+        if not state:
+            # Create directory for extracted images
+            state["images_dir"] = os.path.join("extracted_images", doc.name)
+            os.makedirs(state["images_dir"], exist_ok=True)
+
+            # Path to Next.js public assets
+            state["public_assets_dir"] = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../public/pdf-assets', doc.name))
+            os.makedirs(state["public_assets_dir"], exist_ok=True)
+
+            # Deduplication: global set of hashes
+            state["seen_hashes"] = set()
+            # Images already handled, by xref and by hash of their raw (undecoded) stream
+            state["seen_xrefs"] = set()
+            state["seen_streams"] = set()
+        return state
+
+    @staticmethod
+    def _stream_hash(doc: DocumentContext, xref: int) -> str | None:
+        """
+        Hash of the image's raw stream and its dictionary (size, color space, filters, mask),
+        so the same image embedded twice is found without decoding it, while equal bytes
+        read differently are not. /Length only restates the stream size and is left out.
+        """
+        try:
+            raw = doc.doc.xref_stream_raw(xref)
+            obj = doc.doc.xref_object(xref, compressed=True)
+        except Exception:
+            return None
+        if not raw:
+            return None
+        digest = hashlib.md5(_LENGTH_RE.sub("", obj).encode())
+        digest.update(raw)
+        return digest.hexdigest()
+
+    def extract_page(self, doc: DocumentContext, page_number: int) -> list[dict]:
+        state = self._document_state(doc)
+        images_dir = state["images_dir"]
+        public_assets_dir = state["public_assets_dir"]
+        seen_hashes = state["seen_hashes"]
+        seen_xrefs = state["seen_xrefs"]
+        seen_streams = state["seen_streams"]
 
-        # Path to Next.js public assets
-        public_assets_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../public/pdf-assets', pdf_name))
-        os.makedirs(public_assets_dir, exist_ok=True)
+        page = doc.page(page_number)
+        page_rect = page.rect
+        # For grouping: images of this page, grouped by similar relative_y below
+        page_images = []
 
-        # Deduplication: global set of hashes
-        seen_hashes = set()
-        # For grouping: group images by page and similar relative_y
-        page_groups = defaultdict(list)
+        for img_index, img in enumerate(page.images):
+            xref = img[0]
+            # Every image is extracted once per document, at its first placement, so an
+            # image repeated on many pages (a logo) is only decoded and encoded once
+            if xref in seen_xrefs:
+                continue
+            placements = page.image_placements(xref)
+            if not placements:
+                continue
+            seen_xrefs.add(xref)
+            stream_hash = self._stream_hash(doc, xref)
+            if stream_hash is not None:
+                if stream_hash in seen_streams:
+                    continue  # skip duplicate
+                seen_streams.add(stream_hash)
+            bbox = placements[0]['bbox']
+            try:
+                pix = fitz.Pixmap(doc.doc, xref)
+                if pix.n - pix.alpha < 4:
+                    img_data = pix.tobytes("png")
+                else:
+                    pix1 = fitz.Pixmap(fitz.csRGB, pix)
+                    img_data = pix1.tobytes("png")
+                    pix1 = None
+                img_hash = hashlib.md5(img_data).hexdigest()
+                if img_hash in seen_hashes:
+                    continue  # skip duplicate
+                seen_hashes.add(img_hash)
+                filename = f"page_{page_number}_img_{img_index}_{img_hash[:8]}.png"
+                filepath = os.path.join(images_dir, filename)
+                with open(filepath, "wb") as f:
+                    f.write(img_data)
+                public_path = os.path.join(public_assets_dir, filename)
+                shutil.copyfile(filepath, public_path)
+                rel_x = bbox[0] / page_rect.width
+                rel_y = bbox[1] / page_rect.height
+                rel_width = (bbox[2] - bbox[0]) / page_rect.width
+                rel_height = (bbox[3] - bbox[1]) / page_rect.height
+                img_pil = Image.open(io.BytesIO(img_data))
+                img_width, img_height = img_pil.size
+                page_images.append({
+                    "type": "image",
+                    "bbox": list(bbox),
+                    "page": page_number,
+                    "xref": xref,
+                    "filename": filename,
+                    "filepath": filepath,
+                    "relative_position": {
+                        "x": rel_x,
+                        "y": rel_y,
+                        "width": rel_width,
+                        "height": rel_height
+                    },
+                    "dimensions": {
+                        "width": img_width,
+                        "height": img_height
+                    },
+                    "content_hash": img_hash,
+                    "is_inline": False  # TODO: detect inline images
+                })
+                pix = None
+            except Exception as e:
+                print(f"Error extracting image on page {page_number}: {e}")
+                continue
 
-        for page_number, page in enumerate(doc, start=1):
-            images = page.get_images(full=True)
-            page_rect = page.rect
-            for img_index, img in enumerate(images):
-                xref = img[0]
-                for inst in page.get_image_info(xref):
-                    bbox = inst['bbox']
-                    try:
-                        pix = fitz.Pixmap(doc, xref)
-                        if pix.n - pix.alpha < 4:
-                            img_data = pix.tobytes("png")
-                        else:
-                            pix1 = fitz.Pixmap(fitz.csRGB, pix)
-                            img_data = pix1.tobytes("png")
-                            pix1 = None
-                        img_hash = hashlib.md5(img_data).hexdigest()
-                        if img_hash in seen_hashes:
-                            continue  # skip duplicate
-                        seen_hashes.add(img_hash)
-                        filename = f"page_{page_number}_img_{img_index}_{img_hash[:8]}.png"
-                        filepath = os.path.join(images_dir, filename)
-                        with open(filepath, "wb") as f:
-                            f.write(img_data)
-                        public_path = os.path.join(public_assets_dir, filename)
-                        shutil.copyfile(filepath, public_path)
-                        rel_x = bbox[0] / page_rect.width
-                        rel_y = bbox[1] / page_rect.height
-                        rel_width = (bbox[2] - bbox[0]) / page_rect.width
-                        rel_height = (bbox[3] - bbox[1]) / page_rect.height
-                        img_pil = Image.open(io.BytesIO(img_data))
-                        img_width, img_height = img_pil.size
-                        # For grouping: store by page and rel_y
-                        page_groups[page_number].append({
-                        "type": "image",
-                        "bbox": list(bbox),
-                        "page": page_number,
-                            "xref": xref,
-                            "filename": filename,
-                            "filepath": filepath,
-                            "relative_position": {
-                                "x": rel_x,
-                                "y": rel_y,
-                                "width": rel_width,
-                                "height": rel_height
-                            },
-                            "dimensions": {
-                                "width": img_width,
-                                "height": img_height
-                            },
-                            "content_hash": img_hash,
-                            "is_inline": False  # TODO: detect inline images
-                        })
-                        pix = None
-                    except Exception as e:
-                        print(f"Error extracting image on page {page_number}: {e}")
-                        continue
-        # Grouping: assign group_id to horizontally-aligned images (same page, similar rel_y)
-        grouped_extracted = []
-        for page, imgs in page_groups.items():
-            # Sort by rel_y, then rel_x
-            imgs = sorted(imgs, key=lambda i: (round(i['relative_position']['y'], 2), i['relative_position']['x']))
-            group_id = 0
-            last_y = None
-            for img in imgs:
-                y = round(img['relative_position']['y'], 2)
-                if last_y is not None and abs(y - last_y) > 0.05:
-                    group_id += 1
-                img['group_id'] = f"page{page}_group{group_id}"
-                last_y = y
-                grouped_extracted.append(img)
-        doc.close()
-        return grouped_extracted
+        # Grouping: assign group_id to horizontally-aligned images (similar rel_y)
+        # Sort by rel_y, then rel_x
+        page_images = sorted(page_images, key=lambda i: (round(i['relative_position']['y'], 2), i['relative_position']['x']))
+        group_id = 0
+        last_y = None
+        for img in page_images:
+            y = round(img['relative_position']['y'], 2)
+            if last_y is not None and abs(y - last_y) > 0.05:
+                group_id += 1
+            img['group_id'] = f"page{page_number}_group{group_id}"
+            last_y = y
+        return page_images
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+from contextlib import contextmanager
+
+LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", 60))
+MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+RECOVER_INTERVAL = 30  # seconds between scans for expired leases
+
+
+class JobQueue:
+    """
+    Reliable queue on top of the Redis list the web app pushes jobs to (LPUSH).
+
+    A claimed job is moved atomically into a per-worker processing list. The
+    worker holds a lease key that it renews while polling and that a heartbeat
+    thread keeps alive while a job runs. If the worker dies, its lease expires
+    and another worker moves the job back onto the queue. A job that fails or
+    gets stranded max_attempts times is moved to the dead-letter list.
+
+    Keys, for queue "pdf_jobs":
+      pdf_jobs                         pending jobs (producer LPUSH, consumer takes from the right)
+      pdf_jobs:processing:<worker_id>  jobs claimed by a worker
+      pdf_jobs:lease:<worker_id>       expires when the worker stops heartbeating
+      pdf_jobs:workers                 set of worker ids that may own a processing list
+      pdf_jobs:attempts                hash of raw job -> number of failed attempts
+      pdf_jobs:dead                    dead-letter list
+    """
+    def __init__(self, redis, queue: str = "pdf_jobs", worker_id: str = None,
+                 lease_seconds: int = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS):
+        self.redis = redis
+        self.queue = queue
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        self.workers_key = f"{queue}:workers"
+        self.attempts_key = f"{queue}:attempts"
+        self.dead_key = f"{queue}:dead"
+        self.processing_key = self._processing_key(self.worker_id)
+        self.lease_key = self._lease_key(self.worker_id)
+        self._renew_at = 0.0
+
+    def _processing_key(self, worker_id: str) -> str:
+        return f"{self.queue}:processing:{worker_id}"
+
+    def _lease_key(self, worker_id: str) -> str:
+        return f"{self.queue}:lease:{worker_id}"
+
+    def claim(self) -> str | None:
+        """Move the oldest pending job into this worker's processing list."""
+        # The lease is renewed while polling too, so a reaper never sees a
+        # processing list whose owner is alive but has no lease
+        if time.monotonic() >= self._renew_at:
+            self.heartbeat()
+        return self.redis.lmove(self.queue, self.processing_key, "RIGHT", "LEFT")
+
+    def heartbeat(self):
+        self.redis.set(self.lease_key, str(time.time()), ex=self.lease_seconds)
+        self.redis.sadd(self.workers_key, self.worker_id)
+        self._renew_at = time.monotonic() + self.lease_seconds / 3
+
+    @contextmanager
+    def lease(self, raw_job: str):
+        """Keep the lease alive while the job runs."""
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.lease_seconds / 3):
+                try:
+                    self.heartbeat()
+                except Exception as e:
+                    print(f"Lease heartbeat failed: {e}")
+
+        thread = threading.Thread(target=beat, name="job-lease-heartbeat", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def ack(self, raw_job: str):
+        """The job finished: drop it from the processing list."""
+        self.redis.lrem(self.processing_key, 1, raw_job)
+        self.redis.hdel(self.attempts_key, raw_job)
+
+    def fail(self, raw_job: str, error: str = None):
+        """The job raised: retry it later or dead-letter it after max_attempts."""
+        self._retry_or_bury(raw_job, error)
+        self.redis.lrem(self.processing_key, 1, raw_job)
+
+    def _retry_or_bury(self, raw_job: str, error: str = None, front: bool = False):
+        attempts = self.redis.hincrby(self.attempts_key, raw_job, 1)
+        if attempts >= self.max_attempts:
+            print(f"Job failed {attempts} times, moving it to {self.dead_key}")
+            self.redis.lpush(self.dead_key, json.dumps({
+                "job": raw_job,
+                "error": error,
+                "attempts": attempts,
+                "failed_at": time.time(),
+            }))
+            self.redis.hdel(self.attempts_key, raw_job)
+        elif front:
+            # Stranded jobs were already waiting once, put them next in line
+            self.redis.rpush(self.queue, raw_job)
+        else:
+            self.redis.lpush(self.queue, raw_job)
+
+    def recover_expired(self) -> int:
+        """Requeue jobs held by workers whose lease expired. Returns the number of recovered jobs."""
+        # Only one worker at a time scans, so a stranded job is not requeued twice
+        if not self.redis.set(f"{self.queue}:reaper", self.worker_id, nx=True, ex=RECOVER_INTERVAL):
+            return 0
+
+        recovered = 0
+        for worker_id in self.redis.smembers(self.workers_key):
+            if worker_id == self.worker_id or self.redis.exists(self._lease_key(worker_id)):
+                continue
+            processing_key = self._processing_key(worker_id)
+            while True:
+                raw_job = self.redis.rpop(processing_key)
+                if raw_job is None:
+                    break
+                print(f"Lease of worker {worker_id} expired, requeueing its job")
+                self._retry_or_bury(raw_job, error=f"lease of worker {worker_id} expired", front=True)
+                recovered += 1
+            self.redis.srem(self.workers_key, worker_id)
+        return recovered
+
+    def close(self):
+        """Deregister the worker on a clean shutdown."""
+        self.redis.delete(self.lease_key)
+        self.redis.srem(self.workers_key, self.worker_id)
@@ -0,0 +1,80 @@
+import re
+import json
+
+# Backslashes that do not start a JSON escape, as in LaTeX written with single backslashes
+_STRAY_BACKSLASH = re.compile(r'\\(?!["\\/bfnrtu])')
+
+
+class JSONArrayStream:
+    """
+    Incremental parser for a JSON array that arrives in pieces (a streamed LLM
+    answer). feed() returns the elements completed by the new text, so each
+    object can be used as soon as its closing brace arrives, and a stream cut
+    off mid-element still yields every element before it.
+
+    Anything before the opening bracket (a ```json fence) is skipped. Elements
+    that do not parse, even after escaping stray backslashes, are dropped and
+    counted in .errors.
+    """
+    def __init__(self):
+        self._started = False
+        self.closed = False
+        self._element = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.errors = 0
+
+    @property
+    def pending(self) -> str:
+        """Text of the element being received, if any."""
+        return "".join(self._element)
+
+    def feed(self, text: str) -> list:
+        completed = []
+        for ch in text:
+            if self.closed:
+                break
+            if not self._started:
+                self._started = ch == "["
+                continue
+            if self._depth == 0:
+                if ch in "{[":
+                    self._depth = 1
+                    self._element = [ch]
+                elif ch == "]":
+                    self.closed = True
+                continue
+
+            self._element.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    element = self._decode("".join(self._element))
+                    self._element = []
+                    if element is not None:
+                        completed.append(element)
+        return completed
+
+    def _decode(self, text: str):
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            pass
+        try:
+            return json.loads(_STRAY_BACKSLASH.sub(r'\\\\', text))
+        except json.JSONDecodeError as e:
+            self.errors += 1
+            print(f"Dropping unparseable element from LLM stream: {e}")
+            return None
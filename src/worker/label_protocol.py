@@ -0,0 +1,263 @@
+"""
+Label-only LLM protocol.
+
+Instead of having the model write every sentence back inside a JSON component,
+text is split into sentences locally and sent as numbered lines. The model
+answers with compact labels that refer to line numbers (headings, abstract,
+author block, captions, ...), and the components are rebuilt here from the
+original text. Lines the model does not mention become sentences, so the
+answer only grows with the structure of the page, not with its length.
+"""
+import re
+import textwrap
+
+from json_stream import JSONArrayStream
+
+LABEL_SYSTEM = """
+You label the numbered lines of one page of an academic paper so that the page can be rendered as components. Lines are sentences or short fragments in reading order. Images (I<n>) and tables (T<n>) found on the page are listed after the lines.
+
+Return ONLY a JSON array (no markdown, no explanations). Each entry labels one or more consecutive lines: {"i": [line numbers], "t": label, ...}. Lines you do not mention are body sentences: do NOT list plain sentences.
+
+Labels:
+- "title": the main document title (only on the first page, only once)
+- "author": author names, affiliations and emails. Put ALL authors in ONE entry
+- "abstract": the abstract, including its "Abstract" line
+- "h": a section heading. Add "l" (level: 2 for "1 Introduction", 3 for "1.1", 4 for "1.1.1", 5 for "1.1.1.1") and "n" (section number) when present. "Abstract" is never a heading
+- "footer": footnotes, acknowledgments, equal contribution statements, funding
+- "eq": a display equation. Add "latex" (the equation in LaTeX) and "n" (equation number) if present
+- "list": consecutive list items, one line per item. Add "o": true for a numbered list
+- "quote": a blockquote or callout
+- "code": a code block
+- "ftitle": a figure or table title (e.g. "Figure 1: The Transformer"). Add "n" (figure number) and "k" ("figure" or "table")
+- "fcap": the caption text that follows a figure or table title. Add "n" and "k" like for "ftitle"
+- "drop": page numbers, running headers and other noise
+- "s": a body sentence containing math. Add "text": the sentence with every mathematical expression wrapped in $...$ LaTeX (e.g. $\\theta$, $f_c(x; \\theta)$, $\\frac{a}{b}$)
+
+Objects: for every listed image and table add {"o": "I1", "after": <line number>} with the line it follows, normally its figure or table title. Use "after": -1 to place it before the first line.
+
+Escape backslashes in JSON strings: the LaTeX \\frac is written "\\\\frac".
+"""
+
+LABEL_PROMPT = textwrap.dedent("""
+Label the following lines. Follow the system prompt rules exactly.
+
+**Lines:**
+{}
+{}
+**Output JSON array:**
+""")
+
+# Abbreviations that end with a period without ending the sentence
+ABBREVIATIONS = {
+    "al.", "e.g.", "i.e.", "etc.", "cf.", "vs.", "fig.", "figs.", "eq.", "eqs.", "sec.", "secs.",
+    "tab.", "ref.", "refs.", "no.", "vol.", "pp.", "approx.", "resp.", "dr.", "prof.", "mr.", "ms.",
+}
+_SENTENCE_END = re.compile(r"[.!?][\"')\]]*\s+(?=[A-Z0-9\\$(\[])")
+_INITIAL = re.compile(r"[A-Z]\.")
+
+# The answer is a handful of labels per chunk plus LaTeX rewrites of the sentences with math
+OUTPUT_TOKENS_PER_INPUT_TOKEN = 0.3
+OUTPUT_TOKENS_PER_CHUNK = 12
+OUTPUT_TOKENS_PER_OBJECT = 15
+OUTPUT_TOKENS_BASE = 50
+
+
+def estimate_output_tokens(input_tokens: int, n_chunks: int, n_objects: int = 0) -> int:
+    return int(
+        OUTPUT_TOKENS_BASE
+        + input_tokens * OUTPUT_TOKENS_PER_INPUT_TOKEN
+        + n_chunks * OUTPUT_TOKENS_PER_CHUNK
+        + n_objects * OUTPUT_TOKENS_PER_OBJECT
+    )
+
+
+def split_sentences(text: str) -> list[str]:
+    """Split a text block into sentences, keeping abbreviations and initials ("et al.", "J.") intact."""
+    text = " ".join(text.split())
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        candidate = text[start:match.end()].strip()
+        last_word = candidate.rsplit(" ", 1)[-1]
+        if last_word.lower() in ABBREVIATIONS or _INITIAL.fullmatch(last_word):
+            continue
+        sentences.append(candidate)
+        start = match.end()
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
+
+
+def split_lines(chunks: list[dict]) -> list[dict]:
+    """Numbered units sent to the model: the sentences of every chunk, with the chunk they come from."""
+    lines = []
+    for chunk in chunks:
+        for sentence in split_sentences(chunk.get("content", "")):
+            lines.append({"text": sentence, "chunk": chunk})
+    return lines
+
+
+def object_src(obj: dict) -> str:
+    return obj.get('cdn_url') or obj.get('filename')
+
+
+def object_component(obj: dict, kind: str) -> dict:
+    """Image or Table component for an extracted vision object."""
+    pos = obj.get('relative_position', {})
+    return {
+        'component': kind,
+        'props': {
+            'src': object_src(obj),
+            'alt': obj.get('alt', obj.get('filename', '')),
+            'relative_x': pos.get('x', 0),
+            'relative_y': pos.get('y', 0),
+            'relative_width': pos.get('width', 0),
+            'relative_height': pos.get('height', 0),
+            'group_id': obj.get('group_id'),
+            'is_inline': obj.get('is_inline', False)
+        }
+    }
+
+
+def build_label_prompt(lines: list[dict], images: list[tuple], tables: list[tuple]) -> str:
+    """images and tables are (page-wide number, object) pairs."""
+    numbered = "\n".join(f"[{i}] {line['text']}" for i, line in enumerate(lines))
+    objects = ""
+    for prefix, numbered_objects in (("I", images), ("T", tables)):
+        for number, obj in numbered_objects:
+            pos = obj.get('relative_position')
+            where = f" (y={pos['y']:.2f}-{pos['y'] + pos['height']:.2f})" if pos else ""
+            objects += f"{prefix}{number}{where}\n"
+    if objects:
+        objects = "\n**Objects:**\n" + objects
+    return LABEL_PROMPT.format(numbered, objects)
+
+
+def parse_labels(response: str) -> list[dict]:
+    """
+    Label entries of a model answer. A truncated answer yields the entries it
+    completed, and an unusable one none, so every line stays a sentence.
+    """
+    labels = JSONArrayStream().feed(response)
+    return [entry for entry in labels if isinstance(entry, dict)]
+
+
+def last_labelled_line(labels: list[dict]) -> int:
+    """Highest line number the labels refer to, -1 if none."""
+    numbers = [i for entry in labels for i in entry.get("i", []) if isinstance(i, int)]
+    numbers += [entry["after"] for entry in labels if isinstance(entry.get("after"), int)]
+    return max(numbers, default=-1)
+
+
+def offset_labels(labels: list[dict], offset: int) -> list[dict]:
+    """Labels of a request for lines[offset:], renumbered to refer to the full list of lines."""
+    shifted = []
+    for entry in labels:
+        entry = dict(entry)
+        if isinstance(entry.get("i"), list):
+            entry["i"] = [i + offset if isinstance(i, int) else i for i in entry["i"]]
+        if isinstance(entry.get("after"), int):
+            entry["after"] += offset
+        shifted.append(entry)
+    return shifted
+
+
+def _text_component(text: str) -> dict:
+    return {"component": "Text", "props": {"text": text, "style": "sentence"}}
+
+
+def _labeled_component(entry: dict, texts: list[str]) -> dict | None:
+    label = entry.get("t")
+    joined = " ".join(texts)
+    if label == "title":
+        return {"component": "Title", "props": {"text": joined}}
+    if label == "author":
+        return {"component": "AuthorBlock", "props": {"text": joined, "authors": texts}}
+    if label == "abstract":
+        content = re.sub(r"^\s*abstract[\s.:—-]*", "", joined, flags=re.IGNORECASE)
+        return {"component": "Abstract", "props": {"title": "Abstract", "content": content}}
+    if label == "h":
+        props = {"text": joined, "level": entry.get("l", 2)}
+        if entry.get("n"):
+            props["sectionNumber"] = str(entry["n"])
+            # The section number is a prop of its own
+            props["text"] = re.sub(rf"^{re.escape(str(entry['n']))}\.?\s+", "", joined)
+        return {"component": "Heading", "props": props}
+    if label == "footer":
+        return {"component": "Footer", "props": {"text": joined}}
+    if label == "eq":
+        props = {"latex": entry.get("latex") or joined, "display": True}
+        if entry.get("n"):
+            props["number"] = str(entry["n"])
+        return {"component": "Equation", "props": props}
+    if label == "list":
+        ordered = bool(entry.get("o"))
+        return {"component": "List", "props": {"items": texts, "ordered": ordered, "style": "number" if ordered else "bullet"}}
+    if label == "quote":
+        return {"component": "Blockquote", "props": {"text": joined}}
+    if label == "code":
+        return {"component": "Code", "props": {"code": "\n".join(texts), "inline": False}}
+    if label in ("ftitle", "fcap"):
+        props = {"text": joined, "type": entry.get("k") if entry.get("k") in ("figure", "table", "image") else "figure"}
+        if entry.get("n"):
+            props["figureNumber"] = str(entry["n"])
+        return {"component": "FigureTitle" if label == "ftitle" else "FigureCaption", "props": props}
+    if label == "drop":
+        return None
+    if label == "s" and entry.get("text"):
+        return _text_component(entry["text"])
+    return _text_component(joined)
+
+
+def rebuild_components(lines: list[dict], labels: list[dict], images: list[tuple], tables: list[tuple],
+                       page_size: tuple = None) -> list[dict]:
+    """
+    Components of one chunk group, in line order, from the original line texts
+    and the model's labels. Every image and table is placed: after the line the
+    model chose, otherwise after the last line that starts above it on the page.
+    """
+    objects = {f"I{n}": (obj, "Image") for n, obj in images}
+    objects.update({f"T{n}": (obj, "Table") for n, obj in tables})
+
+    groups = []  # (entry, line numbers it labels)
+    owned = set()
+    placements = {}  # line number -> object ids to emit after it
+    for entry in labels:
+        if "o" in entry:
+            object_id = str(entry["o"])
+            after = entry.get("after")
+            if object_id in objects and isinstance(after, int) and -1 <= after < len(lines):
+                if not any(object_id in ids for ids in placements.values()):
+                    placements.setdefault(after, []).append(object_id)
+            continue
+        indices = sorted({i for i in entry.get("i", []) if isinstance(i, int) and 0 <= i < len(lines)} - owned)
+        if indices:
+            owned.update(indices)
+            groups.append((entry, indices))
+    # A labelled group is emitted at its first line, the others it covers are skipped
+    starts = {indices[0]: (entry, indices) for entry, indices in groups}
+
+    placed = {object_id for ids in placements.values() for object_id in ids}
+    page_height = page_size[1] if page_size else None
+    for object_id, (obj, _) in objects.items():
+        if object_id in placed:
+            continue
+        after = len(lines) - 1
+        pos = obj.get('relative_position')
+        if pos and page_height:
+            above = [i for i, line in enumerate(lines) if line["chunk"].get("bbox", [0, 0])[1] / page_height <= pos['y']]
+            after = above[-1] if above else -1
+        placements.setdefault(after, []).append(object_id)
+
+    components = [object_component(*objects[o]) for o in placements.get(-1, [])]
+    for i, line in enumerate(lines):
+        if i in starts:
+            entry, indices = starts[i]
+            component = _labeled_component(entry, [lines[j]["text"] for j in indices])
+            if component:
+                components.append(component)
+        elif i not in owned:
+            components.append(_text_component(line["text"]))
+        components.extend(object_component(*objects[o]) for o in placements.get(i, []))
+    return components
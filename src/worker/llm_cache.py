@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+CACHE_PATH = os.environ.get(
+    "LLM_CACHE_PATH",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "llm_cache.sqlite3"))
+)
+CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_MB", 512)) * 1024 * 1024
+CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "1") != "0"
+
+
+class LLMCache:
+    """
+    On-disk cache of LLM responses keyed by a hash of the full request
+    (model, system prompt, user prompt and sampling parameters).
+
+    Entries are evicted least-recently-used once the stored responses exceed
+    max_bytes. Safe to share between worker processes (SQLite WAL mode); each
+    process opens its own connection on first use.
+    """
+    def __init__(self, path: str = CACHE_PATH, max_bytes: int = CACHE_MAX_BYTES, enabled: bool = CACHE_ENABLED):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._pid = None
+        self._size = 0
+
+    @staticmethod
+    def key(system: str, prompt: str, params: dict) -> str:
+        request = json.dumps([system, prompt, params], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache (last_access)")
+            self._pid = os.getpid()
+            self._size = self._total_size()
+        return self._db
+
+    def _total_size(self) -> int:
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+
+    def get(self, key: str) -> dict | None:
+        if not self.enabled:
+            return None
+        try:
+            db = self._connect()
+            row = db.execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            db.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return json.loads(row[0])
+        except sqlite3.Error as e:
+            print(f"LLM cache read failed: {e}")
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: dict):
+        if not self.enabled:
+            return
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        try:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, data, size, time.time())
+            )
+            self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+        except sqlite3.Error as e:
+            print(f"LLM cache write failed: {e}")
+
+    def _evict(self):
+        """Drop least recently used entries until the cache is back under 90% of max_bytes."""
+        db = self._db
+        # Other processes write too, so start from the real total
+        self._size = self._total_size()
+        target = self.max_bytes * 0.9
+        while self._size > target:
+            rows = db.execute("SELECT key, size FROM llm_cache ORDER BY last_access LIMIT 100").fetchall()
+            if not rows:
+                break
+            victims = []
+            for key, size in rows:
+                if self._size <= target:
+                    break
+                victims.append((key,))
+                self._size -= size
+            db.executemany("DELETE FROM llm_cache WHERE key = ?", victims)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "bytes": self._size,
+        }
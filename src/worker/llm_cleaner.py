@@ -1,5 +1,15 @@
-import os, textwrap, json, asyncio, re
+import os, textwrap, json, asyncio, re, time
+from functools import lru_cache
 import httpx
+from llm_limiter import AdaptiveLimiter, MAX_CONCURRENCY
+from llm_cache import LLMCache
+import label_protocol
+import fast_path
+from json_stream import JSONArrayStream
+from llm_dispatch import Dispatcher
+from llm_usage import record_call, record_retry
+from llm_retry import (LatencyTracker, resilient_call, is_transient, retry_delay, remaining_time,
+                       attempt_timeout, DeadlineExceeded, MAX_RETRIES)
 SYSTEM = """
 You are an expert academic document analyzer. Your job is to convert raw text chunks and vision objects into a structured JSON array describing components to render. You MUST follow all rules precisely and use all provided context.
 
@@ -142,11 +152,95 @@ Convert the following text chunks into a structured JSON array of components. Fo
 **Output JSON array:**
 """)
 
-MAX_OUTPUT = 1200
+MAX_OUTPUT = 1200  # smallest output budget a request gets
 CHUNK_SIZE = 10
+
+# "components": the model writes every component in full.
+# "labels": sentences are split locally and the model only labels them by index (see label_protocol.py).
+LLM_PROTOCOL = os.environ.get("LLM_PROTOCOL", "components")
+
+# Request sizing. Token counts are estimated from characters: deepseek-chat's
+# tokenizer is not available offline, and 3.5 chars/token errs on the high side
+# for English prose with LaTeX.
+CHARS_PER_TOKEN = 3.5
+MAX_INPUT_TOKENS = int(os.environ.get("LLM_MAX_INPUT_TOKENS", 8000))  # system prompt included
+MAX_OUTPUT_TOKENS = int(os.environ.get("LLM_MAX_OUTPUT_TOKENS", 8000))  # deepseek-chat allows 8192
+# The answer repeats every sentence wrapped in a component object, with LaTeX
+# backslashes doubled, and adds a component per listed image/table
+OUTPUT_TOKENS_PER_INPUT_TOKEN = 2.0
+OUTPUT_TOKENS_PER_CHUNK = 25
+OUTPUT_TOKENS_PER_OBJECT = 80
+OUTPUT_TOKENS_BASE = 50
+
+# Images/tables within this distance (fraction of the page height) of a chunk
+# group's text are listed in that group's prompt
+OBJECT_PROXIMITY = 0.15
 DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
 
-async def fetch_completion(client, prompt):
+# Follow-up requests for the rest of a group after a truncated answer
+MAX_CONTINUATIONS = 3
+
+# Convert blocks with an unambiguous role locally (see fast_path.py) and send only the rest to the LLM
+FAST_PATH = os.environ.get("LLM_FAST_PATH", "1") != "0"
+# Runs of up to this many locally resolved blocks between two LLM runs go to the LLM with them
+FAST_RUN_MIN = 2
+
+llm_limiter = AdaptiveLimiter()
+# Rate budget, fair queuing between jobs and page priority in front of the limiter
+llm_dispatcher = Dispatcher(llm_limiter)
+
+# Recent request latencies, for hedging slow requests
+llm_latencies = LatencyTracker()
+
+# Re-processed or near-duplicate documents send the exact same prompts again
+llm_cache = LLMCache()
+
+# One long-lived HTTP/2 client per worker, so pages and jobs reuse its TLS connections.
+# It is tied to the event loop that first uses it: keep running jobs on the same loop.
+_llm_client = None
+
+def get_llm_client() -> httpx.AsyncClient:
+    global _llm_client
+    if _llm_client is None or _llm_client.is_closed:
+        _llm_client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(60, connect=10),
+            limits=httpx.Limits(
+                max_connections=MAX_CONCURRENCY,
+                max_keepalive_connections=MAX_CONCURRENCY,
+                keepalive_expiry=120,
+            ),
+        )
+    return _llm_client
+
+async def close_llm_client():
+    global _llm_client
+    if _llm_client is not None:
+        await _llm_client.aclose()
+        _llm_client = None
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+def estimate_output_tokens(input_tokens: int, n_chunks: int, n_objects: int = 0) -> int:
+    """Expected size of the JSON answer for n_chunks text chunks totalling input_tokens."""
+    return int(
+        OUTPUT_TOKENS_BASE
+        + input_tokens * OUTPUT_TOKENS_PER_INPUT_TOKEN
+        + n_chunks * OUTPUT_TOKENS_PER_CHUNK
+        + n_objects * OUTPUT_TOKENS_PER_OBJECT
+    )
+
+def output_budget(input_tokens: int, n_chunks: int, n_objects: int = 0, estimate=estimate_output_tokens) -> int:
+    """max_tokens for a request: the estimate plus a quarter of headroom, within the provider limit."""
+    expected = estimate(input_tokens, n_chunks, n_objects)
+    return max(MAX_OUTPUT, min(MAX_OUTPUT_TOKENS, int(expected * 1.25)))
+
+SYSTEM_TOKENS = estimate_tokens(SYSTEM) + estimate_tokens(PROMPT)
+LABEL_SYSTEM_TOKENS = estimate_tokens(label_protocol.LABEL_SYSTEM) + estimate_tokens(label_protocol.LABEL_PROMPT)
+
+async def fetch_completion(client, prompt, max_tokens=MAX_OUTPUT, system=SYSTEM) -> dict:
+    """Returns {"content", "finish_reason", "usage"} of the answer."""
     headers = {
         "Authorization": f"Bearer {os.environ['DEEPSEEK_API_KEY']}",
         "Content-Type": "application/json"
@@ -154,28 +248,161 @@ async def fetch_completion(client, prompt):
     payload = {
         "model": "deepseek-chat",
         "messages": [
-            {"role": "system", "content": SYSTEM},
+            {"role": "system", "content": system},
             {"role": "user", "content": prompt}
         ],
-        "max_tokens": MAX_OUTPUT,
+        "max_tokens": max_tokens,
         "temperature": 0.1,
     }
-    resp = await client.post(DEEPSEEK_API_URL, headers=headers, json=payload)
-    resp.raise_for_status()
-    return resp.json()["choices"][0]["message"]["content"]
+    params = {k: v for k, v in payload.items() if k != "messages"}
+    cache_key = llm_cache.key(system, prompt, params)
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        record_call(cached.get("usage"), 0.0, cached=True, finish_reason=cached.get("finish_reason"))
+        return cached
+
+    # One admission queue and adaptive limit for every request of the worker, whatever page or job it belongs to
+    reserved = estimate_tokens(system) + estimate_tokens(prompt) + max_tokens
+
+    async def post():
+        resp = await client.post(DEEPSEEK_API_URL, headers=headers, json=payload)
+        resp.raise_for_status()
+        body = resp.json()
+        if body.get("usage"):
+            # Still within the attempt's slot, so the unused tokens go back to the budget window it took them from
+            llm_dispatcher.refund(reserved - body["usage"].get("total_tokens", reserved))
+        return body
 
-def smart_chunkify(chunks, max_chars=1200):
+    start = time.monotonic()
+    body = await resilient_call(post, llm_dispatcher, llm_latencies, tokens=reserved)
+    choice = body["choices"][0]
+    result = {
+        "content": choice["message"]["content"],
+        "finish_reason": choice.get("finish_reason"),
+        "usage": body.get("usage"),
+    }
+    record_call(result["usage"], time.monotonic() - start, finish_reason=result["finish_reason"])
+    # Truncated answers are not worth replaying
+    if result["finish_reason"] == "stop":
+        llm_cache.put(cache_key, result)
+    return result
+
+async def stream_completion(client, prompt, max_tokens=MAX_OUTPUT, system=SYSTEM, meta: dict = None):
+    """
+    Like fetch_completion, but yields the answer as it is generated (SSE). The
+    finish_reason and usage of the answer are put in meta once the stream ends.
+    """
+    meta = meta if meta is not None else {}
+    headers = {
+        "Authorization": f"Bearer {os.environ['DEEPSEEK_API_KEY']}",
+        "Content-Type": "application/json"
+    }
+    payload = {
+        "model": "deepseek-chat",
+        "messages": [
+            {"role": "system", "content": system},
+            {"role": "user", "content": prompt}
+        ],
+        "max_tokens": max_tokens,
+        "temperature": 0.1,
+    }
+    params = {k: v for k, v in payload.items() if k != "messages"}
+    cache_key = llm_cache.key(system, prompt, params)
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        meta.update(finish_reason=cached.get("finish_reason"), usage=cached.get("usage"))
+        record_call(meta["usage"], 0.0, cached=True, finish_reason=meta["finish_reason"])
+        yield cached["content"]
+        return
+
+    payload["stream"] = True
+    payload["stream_options"] = {"include_usage": True}
+    content = []
+    reserved = estimate_tokens(system) + estimate_tokens(prompt) + max_tokens
+    start = time.monotonic()
+    # A stream can only be retried before its first token went out
+    for attempt in range(MAX_RETRIES + 1):
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded("job deadline passed")
+        try:
+            async with llm_dispatcher.slot(reserved) as window:
+                async with client.stream("POST", DEEPSEEK_API_URL, headers=headers, json=payload) as resp:
+                    resp.raise_for_status()
+                    lines = resp.aiter_lines()
+                    while True:
+                        # A stalled stream must not hold its slot: every line gets the request
+                        # timeout, and none is waited for past the job deadline
+                        try:
+                            async with attempt_timeout():
+                                line = await anext(lines)
+                        except StopAsyncIteration:
+                            break
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        event = json.loads(data)
+                        if event.get("usage"):
+                            meta["usage"] = event["usage"]
+                        for choice in event.get("choices", []):
+                            if choice.get("finish_reason"):
+                                meta["finish_reason"] = choice["finish_reason"]
+                            delta = choice.get("delta", {}).get("content")
+                            if delta:
+                                content.append(delta)
+                                yield delta
+            break
+        except DeadlineExceeded:
+            raise
+        except Exception as exc:
+            if content or not is_transient(exc) or attempt == MAX_RETRIES:
+                raise
+            delay = retry_delay(attempt, exc)
+            print(f"LLM stream failed ({type(exc).__name__}: {exc}), retrying in {delay:.1f}s")
+            record_retry()
+            await asyncio.sleep(delay)
+
+    record_call(meta.get("usage"), time.monotonic() - start, finish_reason=meta.get("finish_reason"))
+    if meta.get("usage"):
+        llm_dispatcher.refund(reserved - meta["usage"].get("total_tokens", reserved), window)
+    if meta.get("finish_reason") == "stop":
+        llm_cache.put(cache_key, {
+            "content": "".join(content),
+            "finish_reason": "stop",
+            "usage": meta.get("usage"),
+        })
+
+def smart_chunkify(chunks, overhead_tokens=0, n_objects=0,
+                   max_input_tokens=MAX_INPUT_TOKENS, max_output_tokens=MAX_OUTPUT_TOKENS,
+                   system_tokens=SYSTEM_TOKENS, estimate=estimate_output_tokens, count_objects=None):
+    """
+    Pack consecutive chunks into as few requests as possible. A group is closed
+    when the prompt (system prompt, template and overhead_tokens of image/table
+    listings included) would exceed max_input_tokens, or when the expected
+    answer would no longer fit in max_output_tokens. count_objects(group) gives
+    the number of objects a group would be listed with; without it every group
+    counts n_objects. A chunk too large on its own still gets a group of its own.
+    """
+    input_budget = max_input_tokens - system_tokens - overhead_tokens
+    # Leave the same headroom output_budget() adds, so packed groups are not truncated
+    output_limit = max_output_tokens / 1.25
     groups = []
     current = []
-    current_len = 0
+    current_tokens = 0
     for chunk in chunks:
-        chunk_str = chunk.get("content", "")
-        if current and (current_len + len(chunk_str)) > max_chars:
+        tokens = estimate_tokens(chunk.get("content", "")) + 1  # + newline separator
+        if current and (
+            current_tokens + tokens > input_budget
+            or estimate(current_tokens + tokens, len(current) + 1,
+                        count_objects(current + [chunk]) if count_objects else n_objects) > output_limit
+        ):
             groups.append(current)
             current = []
-            current_len = 0
+            current_tokens = 0
         current.append(chunk)
-        current_len += len(chunk_str)
+        current_tokens += tokens
     if current:
         groups.append(current)
     return groups
@@ -240,6 +467,40 @@ def build_figure_mapping(text_chunks, image_objects, table_objects=None):
     return figure_map
 
 
+class ComponentDeduplicator:
+    """
+    Keeps each figure/table, figure title and caption once, and only the first
+    Title. accept() tells whether a component is new given every component
+    accepted before it, so components can be filtered as they stream in.
+    """
+    # Property that identifies a component of each deduplicated type
+    KEYS = {'Image': 'src', 'Table': 'src', 'FigureTitle': 'text', 'FigureCaption': 'text'}
+
+    def __init__(self):
+        self.title_found = False
+        self.seen = {comp_type: set() for comp_type in self.KEYS}
+
+    def accept(self, comp: dict) -> bool:
+        comp_type = comp.get('component', '')
+        props = comp.get('props', {})
+        if comp_type == 'Title':
+            # Only the first title with text is kept, every other title is dropped
+            if self.title_found or not props.get('text', ''):
+                return False
+            self.title_found = True
+            return True
+        key = self.KEYS.get(comp_type)
+        if key is None:
+            return True
+        value = props.get(key, '')
+        if not value:
+            return True
+        if value in self.seen[comp_type]:
+            return False
+        self.seen[comp_type].add(value)
+        return True
+
+
 def deduplicate_components(components):
     """
     Remove duplicate components to ensure each figure/table appears only once.
@@ -247,82 +508,76 @@ def deduplicate_components(components):
     """
     if not components:
         return components
-    
-    # Track seen items globally (across all pages)
-    seen_images = set()  # src URLs
-    seen_tables = set()  # src URLs
-    seen_titles = set()  # text
-    seen_captions = set()  # text
-    seen_main_titles = set()  # text for main titles
-    title_found = False  # Track if we've found a title from page 1
-    
-    deduplicated_components = []
-    
-    # Process components in order
-    for comp in components:
-        comp_type = comp.get('component', '')
-        props = comp.get('props', {})
-        
-        if comp_type == 'Title':
-            # Only allow titles from page 1, and only the first one
-            if not title_found:
-                text = props.get('text', '')
-                if text:
-                    seen_main_titles.add(text)
-                    deduplicated_components.append(comp)
-                    title_found = True
-            # Skip all other titles
-            continue
-                
-        elif comp_type == 'Image':
-            src = props.get('src', '')
-            if src and src not in seen_images:
-                seen_images.add(src)
-                deduplicated_components.append(comp)
-            # Skip if already seen
-            elif src and src in seen_images:
-                continue
-            else:
-                deduplicated_components.append(comp)
-                
-        elif comp_type == 'Table':
-            src = props.get('src', '')
-            if src and src not in seen_tables:
-                seen_tables.add(src)
-                deduplicated_components.append(comp)
-            # Skip if already seen
-            elif src and src in seen_tables:
-                continue
-            else:
-                deduplicated_components.append(comp)
-                
-        elif comp_type == 'FigureTitle':
-            text = props.get('text', '')
-            if text and text not in seen_titles:
-                seen_titles.add(text)
-                deduplicated_components.append(comp)
-            # Skip if already seen
-            elif text and text in seen_titles:
-                continue
-            else:
-                deduplicated_components.append(comp)
-                
-        elif comp_type == 'FigureCaption':
-            text = props.get('text', '')
-            if text and text not in seen_captions:
-                seen_captions.add(text)
-                deduplicated_components.append(comp)
-            # Skip if already seen
-            elif text and text in seen_captions:
-                continue
-            else:
-                deduplicated_components.append(comp)
-                
-        else:
-            # For other component types, just add them
-            deduplicated_components.append(comp)
-    
-    return deduplicated_components
+    dedupe = ComponentDeduplicator()
+    return [comp for comp in components if dedupe.accept(comp)]
+
+
+def normalize_ref(ref: str) -> str:
+    """'Fig. 1', 'Fig.1' and 'fig. 1' all become 'fig.1'."""
+    return ref.replace(' ', '').lower()
+
+
+@lru_cache(maxsize=1024)
+def ref_pattern(ref: str) -> re.Pattern:
+    """
+    Matches a figure reference in text however it is spaced or capitalized, but
+    not inside a longer one: 'Figure 1' matches 'figure 1a' and not 'Figure 10' or 'Figure 1.2'.
+    """
+    body = r"\s*".join(re.escape(c) for c in normalize_ref(ref))
+    return re.compile(rf"(?<!\w){body}(?!\d|\.\d)", re.IGNORECASE)
+
+
+def mentions_ref(text: str, ref: str) -> bool:
+    return bool(ref_pattern(ref).search(text))
+
+
+def figure_ref_index(figure_map: dict) -> dict:
+    """figure_map keyed by normalized reference, built once per page instead of once per component."""
+    return {normalize_ref(ref): url for ref, url in (figure_map or {}).items()}
+
+
+def fix_figure_src(comp: dict, refs: dict):
+    """Replace an Image/Table src written as a figure reference ('Figure1', 'Fig. 1') by its URL."""
+    if refs and comp.get('component') in ('Image', 'Table'):
+        src = comp.get('props', {}).get('src') or ''
+        url = refs.get(normalize_ref(src))
+        if url:
+            comp['props']['src'] = url
+
+
+class ComponentSweep:
+    """
+    Post-processing of the components of a page in one pass: malformed entries
+    are dropped, srcs written as figure references are resolved, duplicates are
+    removed and the images and tables present are indexed, so the ones the
+    model skipped can be added by missing() without rescanning the page.
+    """
+    def __init__(self, figure_map: dict = None):
+        self.refs = figure_ref_index(figure_map)
+        self.dedupe = ComponentDeduplicator()
+        self.present = set()  # (component, src, group_id) of every image and table kept
+
+    def accept(self, comp) -> bool:
+        if not isinstance(comp, dict) or "component" not in comp or not isinstance(comp.get("props"), dict):
+            return False
+        fix_figure_src(comp, self.refs)
+        if not self.dedupe.accept(comp):
+            return False
+        if comp['component'] in ('Image', 'Table'):
+            self.present.add((comp['component'], comp['props'].get('src'), comp['props'].get('group_id')))
+        return True
+
+    def missing(self, images: list[dict] = None, tables: list[dict] = None) -> list[dict]:
+        """Components for every extracted image and table not kept so far."""
+        added = []
+        for kind, objects in (('Image', images or []), ('Table', tables or [])):
+            for obj in objects:
+                if (kind, label_protocol.object_src(obj), obj.get('group_id')) in self.present:
+                    continue
+                comp = label_protocol.object_component(obj, kind)
+                if self.accept(comp):
+                    added.append(comp)
+        return added
 
 
 def build_prompt(text_chunks, image_info, table_info, figure_map=None):
@@ -334,61 +589,323 @@ def build_prompt(text_chunks, image_info, table_info, figure_map=None):
         prompt += "\nIf you see a reference to a figure (e.g., 'Figure 1') or table (e.g., 'Table 1'), use the corresponding image/table src from the mapping above for the 'src' property."
     return prompt
 
-async def process_chunks(chunk_groups, image_info, table_info, figure_map=None):
-    async with httpx.AsyncClient(http2=True, timeout=60) as client:
-        tasks = [fetch_completion(client, build_prompt(group, image_info, table_info, figure_map)) for group in chunk_groups]
-        results = await asyncio.gather(*tasks)
-    return results
+def object_listing(kind, numbered_objects):
+    """Prompt section describing images or tables, given as (number, object) pairs."""
+    if not numbered_objects:
+        return ""
+    info = f"\n\n**{kind}s found in document:**\n"
+    for number, obj in numbered_objects:
+        info += f"- {kind} {number}: {obj.get('filename', 'unknown')} "
+        if 'cdn_url' in obj:
+            info += f"(URL: {obj['cdn_url']}) "
+        if 'relative_position' in obj:
+            pos = obj['relative_position']
+            info += f"(Position: x={pos['x']:.2f}, y={pos['y']:.2f}, w={pos['width']:.2f}, h={pos['height']:.2f}) "
+        if 'dimensions' in obj:
+            dims = obj['dimensions']
+            info += f"(Size: {dims['width']}x{dims['height']}px) "
+        if 'group_id' in obj:
+            info += f"(Group: {obj['group_id']}) "
+        info += "\n"
+    return info
+
+def _vertical_span(item, page_height):
+    """(top, bottom) of a text chunk or vision object as fractions of the page height."""
+    pos = item.get('relative_position')
+    if pos:
+        return pos['y'], pos['y'] + pos['height']
+    bbox = item.get('bbox')
+    if bbox and page_height:
+        return bbox[1] / page_height, bbox[3] / page_height
+    return None
+
+def _span_distance(a, b):
+    if a is None or b is None:
+        return float('inf')
+    return max(0.0, b[0] - a[1], a[0] - b[1])
+
+def _group_span(group, page_height):
+    spans = [span for span in (_vertical_span(c, page_height) for c in group) if span]
+    if not spans:
+        return None
+    return min(top for top, _ in spans), max(bottom for _, bottom in spans)
+
+def _claimed_objects(group, group_span, object_spans, object_srcs, figure_map=None):
+    """Indices of the objects within OBJECT_PROXIMITY of a group or referenced by its text."""
+    text = " ".join(c.get("content", "") for c in group)
+    referenced = {src for ref, src in (figure_map or {}).items() if mentions_ref(text, ref)}
+    return {
+        i for i, (span, src) in enumerate(zip(object_spans, object_srcs))
+        if src in referenced or _span_distance(group_span, span) <= OBJECT_PROXIMITY
+    }
+
+def assign_objects(chunk_groups, objects, page_size=None, figure_map=None):
+    """
+    Pick, for every chunk group, the objects (images and tables) worth listing in
+    its prompt: those within OBJECT_PROXIMITY of the group's text on the page and
+    those its text references through the figure map. An object no group claims
+    goes to the nearest group, so every object is listed at least once.
+    Returns a list of object indices per group. Without a page size every group
+    gets every object.
+    """
+    if not objects:
+        return [[] for _ in chunk_groups]
+    if page_size is None:
+        return [list(range(len(objects))) for _ in chunk_groups]
+
+    page_height = page_size[1]
+    group_spans = [_group_span(group, page_height) for group in chunk_groups]
+    object_spans = [_vertical_span(obj, page_height) for obj in objects]
+    object_srcs = [obj.get('cdn_url') or obj.get('filename') for obj in objects]
+
+    assigned = [_claimed_objects(group, group_span, object_spans, object_srcs, figure_map)
+                for group, group_span in zip(chunk_groups, group_spans)]
 
-async def components_from_chunks(chunks: list[dict], images: list[dict] = None, tables: list[dict] = None) -> list[dict]:
-    """Convert text chunks into structured component descriptions"""
+    claimed = set().union(*assigned)
+    for i, span in enumerate(object_spans):
+        if i not in claimed:
+            nearest = min(range(len(chunk_groups)), key=lambda g: _span_distance(group_spans[g], span))
+            assigned[nearest].add(i)
+    return [sorted(indices) for indices in assigned]
+
+def object_counter(objects, page_size=None, figure_map=None):
+    """
+    Function giving the number of objects assign_objects would give a chunk group
+    for itself, before the unclaimed ones are handed out.
+    """
+    if not objects or page_size is None:
+        return lambda group: len(objects)
+    page_height = page_size[1]
+    object_spans = [_vertical_span(obj, page_height) for obj in objects]
+    object_srcs = [obj.get('cdn_url') or obj.get('filename') for obj in objects]
+    return lambda group: len(_claimed_objects(group, _group_span(group, page_height), object_spans, object_srcs, figure_map))
+
+def group_contexts(chunk_groups, images, tables, page_size=None, figure_map=None):
+    """Image/table listings and figure mapping to send with each chunk group."""
+    images = images or []
+    tables = tables or []
+    objects = images + tables
+    contexts = []
+    for group, indices in zip(chunk_groups, assign_objects(chunk_groups, objects, page_size, figure_map)):
+        # Keep the page-wide numbering, so "Image 3" means the same image in every prompt
+        group_images = [(i + 1, images[i]) for i in indices if i < len(images)]
+        group_tables = [(i - len(images) + 1, tables[i - len(images)]) for i in indices if i >= len(images)]
+        group_map = None
+        if figure_map:
+            text = " ".join(c.get("content", "") for c in group)
+            srcs = {obj.get('cdn_url') or obj.get('filename') for _, obj in group_images + group_tables}
+            group_map = {ref: src for ref, src in figure_map.items() if mentions_ref(text, ref) or src in srcs} or None
+        contexts.append({
+            "image_info": object_listing("Image", group_images),
+            "table_info": object_listing("Table", group_tables),
+            "figure_map": group_map,
+            "n_objects": len(indices),
+            "images": group_images,
+            "tables": group_tables,
+        })
+    return contexts
+
+def component_text(comp: dict) -> str:
+    """The source text a component reproduces, as far as it has one."""
+    props = comp.get('props', {})
+    if not isinstance(props, dict):
+        return ""
+    for key in ('text', 'content', 'code'):
+        if isinstance(props.get(key), str):
+            return props[key]
+    items = props.get('items')
+    if isinstance(items, list) and items and isinstance(items[-1], str):
+        return items[-1]
+    return ""
+
+_WORD_RE = re.compile(r"[A-Za-z]{3,}")
+# A component rewritten with LaTeX is located by the sentence holding most of its last words
+LOCATE_TAIL_WORDS = 8
+LOCATE_MIN_OVERLAP = 0.6
+
+def _locate_by_words(normalized: list[str], written: str) -> tuple[int, int] | None:
+    """(text index, end offset) of the last sentence containing most of the last words of written."""
+    tail = [w.lower() for w in _WORD_RE.findall(written)][-LOCATE_TAIL_WORDS:]
+    if len(tail) < 3:
+        return None
+    for i in range(len(normalized) - 1, -1, -1):
+        end = len(normalized[i])
+        for sentence in reversed(label_protocol.split_sentences(normalized[i])):
+            start = normalized[i].rfind(sentence, 0, end)
+            words = {w.lower() for w in _WORD_RE.findall(sentence)}
+            if sum(w in words for w in tail) >= LOCATE_MIN_OVERLAP * len(tail):
+                return i, start + len(sentence)
+            end = max(start, 0)
+    return None
+
+def unfinished_texts(texts: list[str], components: list) -> list[str] | None:
+    """
+    The part of a chunk group a truncated answer did not reach: everything after
+    the end of the last component whose text is found in the input, verbatim or,
+    for text rewritten with LaTeX, by its words. None when no component can be located.
+    """
+    normalized = [" ".join(text.split()) for text in texts]
+    for comp in reversed(components):
+        if not isinstance(comp, dict):
+            continue
+        written = " ".join(component_text(comp).split())
+        if len(written) < 8:
+            continue  # too short to locate reliably
+        probe = written[-40:]
+        for i in range(len(normalized) - 1, -1, -1):
+            pos = normalized[i].rfind(probe)
+            if pos != -1:
+                rest = normalized[i][pos + len(probe):].strip()
+                return ([rest] if rest else []) + texts[i + 1:]
+        located = _locate_by_words(normalized, written)
+        if located:
+            i, end = located
+            rest = normalized[i][end:].strip()
+            return ([rest] if rest else []) + texts[i + 1:]
+    return None
+
+async def complete_group(client, texts: list[str], ctx: dict, depth: int = 0) -> list[str]:
+    """
+    Answers (JSON arrays) covering one chunk group. When an answer is cut off at
+    max_tokens, its complete components are kept and only the text it did not
+    reach is requested again; if that cannot be located the group is split in
+    two and both halves are requested instead.
+    """
+    prompt = build_prompt(texts, ctx["image_info"], ctx["table_info"], ctx["figure_map"])
+    group_tokens = sum(estimate_tokens(text) for text in texts)
+    # Follow-ups get more room than the estimate that was just proven too small
+    max_tokens = min(MAX_OUTPUT_TOKENS, output_budget(group_tokens, len(texts), ctx["n_objects"]) * 2 ** depth)
+    result = await fetch_completion(client, prompt, max_tokens=max_tokens)
+    if result["finish_reason"] != "length":
+        return [result["content"]]
+
+    completed = JSONArrayStream().feed(result["content"])
+    remainder = unfinished_texts(texts, completed)
+    if remainder is None:
+        # Where the answer stopped is unknown, so it is replaced: by answers for smaller parts of
+        # the group (a single chunk is split into its sentences) or, at the limit, by plain text
+        parts = texts if len(texts) > 1 else label_protocol.split_sentences(texts[0])
+        if depth >= MAX_CONTINUATIONS or len(parts) < 2:
+            print(f"LLM answer truncated at {max_tokens} tokens and could not be located, keeping the group as plain text")
+            return [json.dumps(fallback_components(texts))]
+        print(f"LLM answer truncated at {max_tokens} tokens, splitting the group into {len(parts)} parts")
+        half = len(parts) // 2
+        first, second = await asyncio.gather(
+            complete_group(client, parts[:half], ctx, depth + 1),
+            complete_group(client, parts[half:], ctx, depth + 1),
+        )
+        return first + second
+    answers = [json.dumps(completed)]
+    if remainder and depth >= MAX_CONTINUATIONS:
+        print(f"LLM answer truncated at {max_tokens} tokens after {depth} continuations, keeping the rest as plain text")
+        answers.append(json.dumps(fallback_components(remainder)))
+    elif remainder:
+        print(f"LLM answer truncated at {max_tokens} tokens, requesting the remaining {len(remainder)} chunks")
+        answers += await complete_group(client, remainder, ctx, depth + 1)
+    return answers
+
+def fallback_components(texts: list[str]) -> list[dict]:
+    """Plain sentences for text the LLM could not process, so the page keeps its content."""
+    return [
+        {"component": "Text", "props": {"text": sentence, "style": "sentence"}}
+        for text in texts
+        for sentence in label_protocol.split_sentences(text)
+    ]
+
+async def process_chunks(chunk_groups, contexts):
+    client = get_llm_client()
+    tasks = [complete_group(client, group, ctx) for group, ctx in zip(chunk_groups, contexts)]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    # One or more answers per group, in page order
+    answers = []
+    for group, result in zip(chunk_groups, results):
+        if isinstance(result, BaseException):
+            # A group that timed out or kept failing does not fail the whole page
+            if not is_transient(result):
+                raise result
+            print(f"LLM request gave up ({type(result).__name__}), keeping {len(group)} chunks as plain text")
+            result = [json.dumps(fallback_components(group))]
+        answers.extend(result)
+    return answers
+
+def plan_requests(text_chunks, images=None, tables=None, page_size=None):
+    """Figure mapping, chunk groups and per-group prompt context for one page."""
+    # Build figure mapping
+    figure_map = build_figure_mapping(text_chunks, images or [], tables) if images or tables else None
+
+    # Use smart chunking. Which objects a group gets is only known once groups are
+    # formed, so the prompt reserves room for the full page listing, while the expected
+    # answer counts the objects near (or referenced by) the group being packed
+    all_listings = object_listing("Image", list(enumerate(images or [], 1))) + object_listing("Table", list(enumerate(tables or [], 1)))
+    overhead_tokens = estimate_tokens(build_prompt([], all_listings, "", figure_map)) - estimate_tokens(PROMPT)
+    count_objects = object_counter((images or []) + (tables or []), page_size, figure_map)
+    if LLM_PROTOCOL == "labels":
+        chunk_groups = smart_chunkify(text_chunks, overhead_tokens=overhead_tokens, count_objects=count_objects,
+                                      system_tokens=LABEL_SYSTEM_TOKENS, estimate=label_protocol.estimate_output_tokens)
+    else:
+        chunk_groups = smart_chunkify(text_chunks, overhead_tokens=overhead_tokens, count_objects=count_objects)
+    contexts = group_contexts(chunk_groups, images, tables, page_size, figure_map)
+    return figure_map, chunk_groups, contexts
+
+async def label_lines(client, lines: list[dict], ctx: dict, depth: int = 0) -> list[dict]:
+    """
+    Labels for one chunk group's lines. A truncated answer keeps the entries it
+    completed, and the lines after the last one it labelled are requested again.
+    """
+    prompt = label_protocol.build_label_prompt(lines, ctx["images"], ctx["tables"])
+    group_tokens = sum(estimate_tokens(line["text"]) for line in lines)
+    n_chunks = len({id(line["chunk"]) for line in lines})
+    max_tokens = output_budget(group_tokens, n_chunks, ctx["n_objects"], estimate=label_protocol.estimate_output_tokens)
+    max_tokens = min(MAX_OUTPUT_TOKENS, max_tokens * 2 ** depth)
+    result = await fetch_completion(client, prompt, max_tokens=max_tokens, system=label_protocol.LABEL_SYSTEM)
+    labels = label_protocol.parse_labels(result["content"])
+    if result["finish_reason"] != "length" or depth >= MAX_CONTINUATIONS:
+        return labels
+
+    reached = label_protocol.last_labelled_line(labels)
+    if reached + 1 >= len(lines):
+        return labels
+    print(f"LLM labels truncated at {max_tokens} tokens, requesting lines {reached + 1}-{len(lines) - 1} again")
+    rest = await label_lines(client, lines[reached + 1:], ctx, depth + 1)
+    return labels + label_protocol.offset_labels(rest, reached + 1)
+
+async def labeled_components(chunk_groups, contexts, page_size=None):
+    """Label protocol: one label request per chunk group, components rebuilt locally from the page text."""
+    client = get_llm_client()
+    requests = [label_protocol.split_lines(group) for group in chunk_groups]
+    results = await asyncio.gather(*[label_lines(client, lines, ctx) for lines, ctx in zip(requests, contexts)],
+                                   return_exceptions=True)
+
+    components = []
+    for lines, ctx, labels in zip(requests, contexts, results):
+        if isinstance(labels, BaseException):
+            # Without labels every line is rebuilt as a sentence
+            if not is_transient(labels):
+                raise labels
+            print(f"LLM request gave up ({type(labels).__name__}), keeping {len(lines)} lines as plain text")
+            labels = []
+        components.extend(label_protocol.rebuild_components(lines, labels, ctx["images"], ctx["tables"], page_size))
+    return deduplicate_components(components)
+
+async def llm_components(chunks: list[dict], images: list[dict] = None, tables: list[dict] = None,
+                         page_size: tuple = None) -> list[dict]:
+    """
+    Convert text chunks into structured component descriptions with the LLM.
+    With page_size (width, height in points, the unit of the chunk bboxes), each
+    request lists only the images and tables near its text.
+    """
     text_chunks = [c for c in chunks if c.get("content")]
     if not text_chunks:
         return []
 
-    # Prepare image and table information for LLM
-    image_info = ""
-    if images:
-        image_info = "\n\n**Images found in document:**\n"
-        for i, img in enumerate(images):
-            image_info += f"- Image {i+1}: {img.get('filename', 'unknown')} "
-            if 'cdn_url' in img:
-                image_info += f"(URL: {img['cdn_url']}) "
-            if 'relative_position' in img:
-                pos = img['relative_position']
-                image_info += f"(Position: x={pos['x']:.2f}, y={pos['y']:.2f}, w={pos['width']:.2f}, h={pos['height']:.2f}) "
-            if 'dimensions' in img:
-                dims = img['dimensions']
-                image_info += f"(Size: {dims['width']}x{dims['height']}px) "
-            if 'group_id' in img:
-                image_info += f"(Group: {img['group_id']}) "
-            image_info += "\n"
-
-    table_info = ""
-    if tables:
-        table_info = "\n\n**Tables found in document:**\n"
-        for i, table in enumerate(tables):
-            table_info += f"- Table {i+1}: {table.get('filename', 'unknown')} "
-            if 'cdn_url' in table:
-                table_info += f"(URL: {table['cdn_url']}) "
-            if 'relative_position' in table:
-                pos = table['relative_position']
-                table_info += f"(Position: x={pos['x']:.2f}, y={pos['y']:.2f}, w={pos['width']:.2f}, h={pos['height']:.2f}) "
-            if 'dimensions' in table:
-                dims = table['dimensions']
-                table_info += f"(Size: {dims['width']}x{dims['height']}px) "
-            if 'group_id' in table:
-                table_info += f"(Group: {table['group_id']}) "
-            table_info += "\n"
-
-    # Use smart chunking
-    chunk_groups = smart_chunkify(text_chunks, max_chars=1200)
+    figure_map, chunk_groups, contexts = plan_requests(text_chunks, images, tables, page_size)
+    if LLM_PROTOCOL == "labels":
+        return await labeled_components(chunk_groups, contexts, page_size)
+
     # Each group is a list of chunk dicts - convert to list of strings for prompt
     chunk_groups_str = [[c.get("content", "") for c in group] for group in chunk_groups]
-    # Build figure mapping
-    figure_map = build_figure_mapping(text_chunks, images or [], tables) if images or tables else None
-    
-    llm_results = await process_chunks(chunk_groups_str, image_info, table_info, figure_map)
+
+    llm_results = await process_chunks(chunk_groups_str, contexts)
 
     # Merge and parse all results
     all_components = []
@@ -456,79 +973,206 @@ async def components_from_chunks(chunks: list[dict], images: list[dict] = None,
                     }
                 }
             ]
-        # --- Post-processing: fix 'src': 'Figure1' etc. ---
-        if figure_map:
-            for comp in components:
-                if comp.get('component') in ['Image', 'Table']:
-                    src = comp.get('props', {}).get('src', '')
-                    # Try to match 'Figure1', 'Fig. 1', etc.
-                    for ref, url in figure_map.items():
-                        if src.replace(' ', '').lower() == ref.replace(' ', '').lower() or src.lower() == ref.lower().replace(' ', ''):
-                            comp['props']['src'] = url
-        # --- End post-processing ---
-        for i, component in enumerate(components):
-            if not isinstance(component, dict) or "component" not in component or "props" not in component:
-                continue
-            all_components.append(component)
-
-    # --- Post-processing: ensure every extracted image/table is present ---
-    # Add any missing images
-    if images:
-        for img in images:
-            src = img.get('cdn_url') or img.get('filename')
-            group_id = img.get('group_id')
-            found = any(
-                c.get('component') == 'Image' and
-                c.get('props', {}).get('src') == src and
-                c.get('props', {}).get('group_id') == group_id
-                for c in all_components
-            )
-            if not found:
-                # Add missing image as an Image component
-                all_components.append({
-                    'component': 'Image',
-                    'props': {
-                        'src': src,
-                        'alt': img.get('alt', img.get('filename', '')),
-                        'relative_x': img.get('relative_position', {}).get('x', 0),
-                        'relative_y': img.get('relative_position', {}).get('y', 0),
-                        'relative_width': img.get('relative_position', {}).get('width', 0),
-                        'relative_height': img.get('relative_position', {}).get('height', 0),
-                        'group_id': group_id,
-                        'is_inline': img.get('is_inline', False)
-                    }
-                })
-    # Add any missing tables
-    if tables:
-        for table in tables:
-            src = table.get('cdn_url') or table.get('filename')
-            group_id = table.get('group_id')
-            found = any(
-                c.get('component') == 'Table' and
-                c.get('props', {}).get('src') == src and
-                c.get('props', {}).get('group_id') == group_id
-                for c in all_components
-            )
-            if not found:
-                all_components.append({
-                    'component': 'Table',
-                    'props': {
-                        'src': src,
-                        'alt': table.get('alt', table.get('filename', '')),
-                        'relative_x': table.get('relative_position', {}).get('x', 0),
-                        'relative_y': table.get('relative_position', {}).get('y', 0),
-                        'relative_width': table.get('relative_position', {}).get('width', 0),
-                        'relative_height': table.get('relative_position', {}).get('height', 0),
-                        'group_id': group_id,
-                        'is_inline': table.get('is_inline', False)
-                    }
-                })
+        all_components.extend(components)
 
-    # Apply deduplication to remove any remaining duplicates
-    all_components = deduplicate_components(all_components)
-    
+    # Resolve figure srcs and drop duplicates in one pass, then add every image/table the model skipped
+    sweep = ComponentSweep(figure_map)
+    all_components = [comp for comp in all_components if sweep.accept(comp)]
+    all_components.extend(sweep.missing(images, tables))
     return all_components
 
+async def stream_llm_components(chunks: list[dict], images: list[dict] = None, tables: list[dict] = None,
+                                page_size: tuple = None):
+    """
+    Streaming variant of llm_components: yields each component as soon
+    as the model has finished writing it. All chunk groups are requested at
+    once, and their components are yielded in page order: the first group's
+    as they arrive, the later ones' as soon as the groups before them are done.
+    A truncated answer still yields every component completed before the cut.
+    """
+    text_chunks = [c for c in chunks if c.get("content")]
+    if not text_chunks:
+        return
+
+    figure_map, chunk_groups, contexts = plan_requests(text_chunks, images, tables, page_size)
+    if LLM_PROTOCOL == "labels":
+        # Labels refer to lines across the whole answer, so a group is rebuilt once its answer is complete
+        for comp in await labeled_components(chunk_groups, contexts, page_size):
+            yield comp
+        return
+
+    client = get_llm_client()
+
+    async def produce(group, ctx, queue):
+        texts = [c.get("content", "") for c in group]
+        streamed = []
+        try:
+            for depth in range(MAX_CONTINUATIONS + 1):
+                prompt = build_prompt(texts, ctx["image_info"], ctx["table_info"], ctx["figure_map"])
+                max_tokens = output_budget(sum(estimate_tokens(t) for t in texts), len(texts), ctx["n_objects"])
+                max_tokens = min(MAX_OUTPUT_TOKENS, max_tokens * 2 ** depth)
+                parser = JSONArrayStream()
+                meta = {}
+                streamed = []
+                async for delta in stream_completion(client, prompt, max_tokens=max_tokens, meta=meta):
+                    for comp in parser.feed(delta):
+                        streamed.append(comp)
+                        queue.put_nowait(comp)
+                if meta.get("finish_reason") != "length":
+                    break
+                # Components already went out, so only a located remainder can be requested again
+                remainder = unfinished_texts(texts, streamed)
+                if remainder is None:
+                    # Nothing can be taken back: the group's text follows as plain text so none is lost
+                    print(f"LLM answer truncated at {max_tokens} tokens and could not be located, adding the group as plain text")
+                    for comp in fallback_components(texts):
+                        queue.put_nowait(comp)
+                    break
+                texts = remainder
+                if not texts:
+                    break
+                if depth == MAX_CONTINUATIONS:
+                    print(f"LLM answer truncated at {max_tokens} tokens after {depth} continuations, keeping the rest as plain text")
+                    for comp in fallback_components(texts):
+                        queue.put_nowait(comp)
+                    break
+                print(f"LLM answer truncated at {max_tokens} tokens, requesting the remaining {len(texts)} chunks")
+        except Exception as exc:
+            if not is_transient(exc):
+                raise
+            # Whatever the stream did not reach is kept as plain text
+            rest = unfinished_texts(texts, streamed) if streamed else texts
+            print(f"LLM stream gave up ({type(exc).__name__}), keeping the rest of the group as plain text")
+            for comp in fallback_components(texts if rest is None else rest):
+                queue.put_nowait(comp)
+        finally:
+            queue.put_nowait(None)
+
+    queues = [asyncio.Queue() for _ in chunk_groups]
+    tasks = [asyncio.create_task(produce(group, ctx, queue)) for group, ctx, queue in zip(chunk_groups, contexts, queues)]
+    sweep = ComponentSweep(figure_map)
+    try:
+        for queue in queues:
+            while (comp := await queue.get()) is not None:
+                if sweep.accept(comp):
+                    yield comp
+        # Surface request errors like the non-streaming path does
+        await asyncio.gather(*tasks)
+
+        # Every extracted image/table is present, even if the model skipped it
+        for comp in sweep.missing(images, tables):
+            yield comp
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def plan_segments(text_chunks: list[dict], images: list[dict] = None, tables: list[dict] = None,
+                  page_size: tuple = None) -> list[dict]:
+    """
+    Split a page into runs of blocks the fast path resolves ({"kind": "fast",
+    "components"}) and runs that need the LLM ({"kind": "llm", "chunks",
+    "images", "tables"}), in block order. Short resolved runs between two LLM
+    runs are sent to the LLM too, rather than splitting its request around
+    them. Each image and table goes to the nearest LLM run, or is placed by
+    position when the whole page is resolved without the LLM.
+    """
+    classified = [fast_path.classify_block(chunk, page_size, text_chunks) for chunk in text_chunks]
+    llm_indices = [i for i, comps in enumerate(classified) if comps is None]
+    if not llm_indices:
+        return [{"kind": "fast", "components": fast_path.place_objects(list(zip(text_chunks, classified)), images, tables, page_size)}]
+
+    for start, end in zip(llm_indices, llm_indices[1:]):
+        if 0 < end - start - 1 <= FAST_RUN_MIN:
+            for i in range(start + 1, end):
+                classified[i] = None
+
+    segments = []
+    for chunk, comps in zip(text_chunks, classified):
+        kind = "llm" if comps is None else "fast"
+        if not segments or segments[-1]["kind"] != kind:
+            segments.append({"kind": kind, "chunks": [], "components": [], "images": [], "tables": []})
+        segments[-1]["chunks"].append(chunk)
+        if comps:
+            segments[-1]["components"].extend(comps)
+
+    llm_segments = [segment for segment in segments if segment["kind"] == "llm"]
+    page_height = page_size[1] if page_size else None
+    spans = [_group_span(segment["chunks"], page_height) for segment in llm_segments]
+    for key, objects in (("images", images or []), ("tables", tables or [])):
+        for obj in objects:
+            span = _vertical_span(obj, page_height)
+            nearest = min(range(len(llm_segments)), key=lambda i: _span_distance(spans[i], span))
+            llm_segments[nearest][key].append(obj)
+    return segments
+
+async def components_from_chunks(chunks: list[dict], images: list[dict] = None, tables: list[dict] = None,
+                                 page_size: tuple = None) -> list[dict]:
+    """
+    Convert text chunks into structured component descriptions. Blocks the
+    fast path recognizes are converted locally and only the rest goes to the
+    LLM; page_size (width, height in points) lets both place images and tables.
+    """
+    text_chunks = [c for c in chunks if c.get("content")]
+    if not text_chunks:
+        return []
+    if not FAST_PATH:
+        return await llm_components(text_chunks, images, tables, page_size)
+
+    segments = plan_segments(text_chunks, images, tables, page_size)
+    llm_segments = [segment for segment in segments if segment["kind"] == "llm"]
+    results = iter(await asyncio.gather(*[
+        llm_components(segment["chunks"], segment["images"], segment["tables"], page_size)
+        for segment in llm_segments
+    ]))
+    components = []
+    for segment in segments:
+        components.extend(segment["components"] if segment["kind"] == "fast" else next(results))
+    return deduplicate_components(components)
+
+async def stream_components(chunks: list[dict], images: list[dict] = None, tables: list[dict] = None,
+                            page_size: tuple = None):
+    """
+    Streaming variant of components_from_chunks: fast-path components are
+    yielded right away, LLM runs as their answers stream in, in block order.
+    """
+    text_chunks = [c for c in chunks if c.get("content")]
+    if not text_chunks:
+        return
+    if not FAST_PATH:
+        async for comp in stream_llm_components(text_chunks, images, tables, page_size):
+            yield comp
+        return
+
+    async def drain(segment, queue):
+        try:
+            async for comp in stream_llm_components(segment["chunks"], segment["images"], segment["tables"], page_size):
+                queue.put_nowait(comp)
+        finally:
+            queue.put_nowait(None)
+
+    segments = plan_segments(text_chunks, images, tables, page_size)
+    queues = {}
+    tasks = []
+    for i, segment in enumerate(segments):
+        if segment["kind"] == "llm":
+            queues[i] = asyncio.Queue()
+            tasks.append(asyncio.create_task(drain(segment, queues[i])))
+    dedupe = ComponentDeduplicator()
+    try:
+        for i, segment in enumerate(segments):
+            if segment["kind"] == "fast":
+                for comp in segment["components"]:
+                    if dedupe.accept(comp):
+                        yield comp
+                continue
+            while (comp := await queues[i].get()) is not None:
+                if dedupe.accept(comp):
+                    yield comp
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
 # Keep the old function for backward compatibility
 def tsx_from_chunks(chunks: list[dict]) -> str:
     """Legacy function that converts chunks to HTML - kept for compatibility"""
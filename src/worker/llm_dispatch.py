@@ -0,0 +1,296 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import contextvars
+from collections import deque
+from contextlib import asynccontextmanager
+
+from llm_limiter import AdaptiveLimiter
+
+# Provider rate budget, 0 means no limit of that kind. With a SharedBudget it is
+# enforced across every worker through Redis, otherwise split evenly between
+# the processes of the pool.
+HOST_RPM = int(os.environ.get("LLM_RPM", 0))
+HOST_TPM = int(os.environ.get("LLM_TPM", 0))
+WORKER_PROCESSES = max(1, int(os.environ.get("PDF_WORKER_PROCESSES", 1)))
+BUDGET_WINDOW = 60  # seconds
+
+current_job = contextvars.ContextVar("llm_job", default=None)
+current_priority = contextvars.ContextVar("llm_priority", default=0)
+# Shared budget window the request running in this context took its tokens from
+budget_window = contextvars.ContextVar("llm_budget_window", default=None)
+
+
+def set_job(job: str):
+    """Attribute the LLM requests made from the current context to a job."""
+    current_job.set(job)
+
+
+def set_priority(priority: int):
+    """Lower goes first within a job, e.g. the page number."""
+    current_priority.set(priority)
+
+
+class TokenBucket:
+    """Refills continuously at per_minute / 60 per second, holding at most one minute's worth."""
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount can be taken, 0 if it can be taken now."""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        # A request larger than the bucket only waits for a full bucket
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        if not self.unlimited:
+            self.tokens -= amount
+
+    def refund(self, amount: float):
+        if not self.unlimited:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class SharedBudget:
+    """
+    Requests/min and tokens/min counted in Redis, so every worker process and
+    host shares one budget and the share of idle workers is not lost. Counts
+    are kept per one-minute window; a request that does not fit waits for the
+    next window. Unused tokens go back to the window they were taken from,
+    and are dropped once that window is over.
+    """
+    # Takes one request and ARGV[1] tokens unless that goes over a limit (ARGV[2], ARGV[3], 0 = none).
+    # A request larger than the whole token budget still goes through in an otherwise empty window.
+    TAKE = """
+    local requests = redis.call('INCRBY', KEYS[1], 1)
+    local tokens = redis.call('INCRBY', KEYS[2], ARGV[1])
+    local rpm, tpm, cost = tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[1])
+    if (rpm > 0 and requests > rpm) or (tpm > 0 and tokens > tpm and tokens > cost) then
+        redis.call('DECRBY', KEYS[1], 1)
+        redis.call('DECRBY', KEYS[2], ARGV[1])
+        return 0
+    end
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+    redis.call('EXPIRE', KEYS[2], ARGV[4])
+    return 1
+    """
+    REFUND = """
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return 0
+    end
+    if redis.call('DECRBY', KEYS[1], ARGV[1]) < 0 then
+        redis.call('SET', KEYS[1], 0, 'EX', ARGV[2])
+    end
+    return 1
+    """
+
+    def __init__(self, redis, rpm: int = HOST_RPM, tpm: int = HOST_TPM, prefix: str = "llm_budget"):
+        self.redis = redis
+        self.rpm = rpm
+        self.tpm = tpm
+        self.prefix = prefix
+
+    def _keys(self, window: int) -> list[str]:
+        return [f"{self.prefix}:requests:{window}", f"{self.prefix}:tokens:{window}"]
+
+    def take(self, tokens: int) -> tuple[float, int]:
+        """
+        Take a request of tokens from the current window. Returns (0, the window) if taken,
+        else (seconds until the next window, the current window).
+        """
+        now = time.time()
+        window = int(now // BUDGET_WINDOW)
+        taken = self.redis.eval(self.TAKE, keys=self._keys(window),
+                                args=[int(tokens), self.rpm, self.tpm, BUDGET_WINDOW * 2])
+        if int(taken):
+            return 0.0, window
+        return (window + 1) * BUDGET_WINDOW - now + 0.01, window
+
+    def refund(self, tokens: int, window: int):
+        """Give tokens back to the window they were taken from, unless it is over: the next one never spent them."""
+        if window != int(time.time() // BUDGET_WINDOW):
+            return
+        self.redis.eval(self.REFUND, keys=self._keys(window)[1:], args=[int(tokens), BUDGET_WINDOW * 2])
+
+
+class Dispatcher:
+    """
+    Admission in front of the adaptive limiter for every LLM request of the worker.
+
+    A request is let through when the limiter has a free slot and the
+    requests/min and tokens/min buckets allow it. Waiting requests are queued
+    per job and served round-robin across jobs, so no job starves, and by
+    priority within a job, so the first pages of a document are answered first.
+
+    With use_shared_budget() the rate budget is taken from Redis instead of
+    the local buckets. Fairness between jobs only holds among the jobs of one
+    process: requests of different processes take the shared budget first come,
+    first served.
+    """
+    def __init__(self, limiter: AdaptiveLimiter, rpm: int = HOST_RPM // WORKER_PROCESSES,
+                 tpm: int = HOST_TPM // WORKER_PROCESSES):
+        self.limiter = limiter
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._queues = {}  # job -> heap of (priority, seq, tokens, future)
+        self._rotation = deque()  # jobs with waiting requests, in serving order
+        self._seq = itertools.count()
+        self._granted = 0  # admitted requests that have not taken their limiter slot yet
+        self._timer = None
+        self.shared = None
+        limiter.add_listener(self._dispatch)
+
+    def use_shared_budget(self, budget: SharedBudget):
+        """Enforce the rate budget through Redis, shared by every worker, instead of this process's share."""
+        self.shared = budget
+        self.requests = TokenBucket(0)
+        self.tokens = TokenBucket(0)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for queue in self._queues.values() for *_, future in queue if not future.done())
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue_depth,
+            "jobs_waiting": len(self._rotation),
+            "rpm_available": None if self.requests.unlimited else int(self.requests.tokens),
+            "tpm_available": None if self.tokens.unlimited else int(self.tokens.tokens),
+        }
+
+    def has_capacity(self) -> bool:
+        return self.limiter.in_flight + self._granted < self.limiter.limit
+
+    async def _admit(self, tokens: int):
+        job = current_job.get()
+        future = asyncio.get_running_loop().create_future()
+        if job not in self._queues:
+            self._queues[job] = []
+            self._rotation.append(job)
+        heapq.heappush(self._queues[job], (current_priority.get(), next(self._seq), tokens, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._granted -= 1  # admitted just before the cancellation
+                self._dispatch()
+            raise
+
+    def _next_request(self):
+        """Head request of the next job in rotation, skipping cancelled ones."""
+        while self._rotation:
+            job = self._rotation[0]
+            queue = self._queues[job]
+            while queue and queue[0][3].done():
+                heapq.heappop(queue)
+            if queue:
+                return job, queue[0]
+            self._rotation.popleft()
+            del self._queues[job]
+        return None
+
+    def _dispatch(self):
+        while self.has_capacity():
+            head = self._next_request()
+            if head is None:
+                return
+            job, (_, _, tokens, future) = head
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+            if wait > 0:
+                self._schedule(wait)
+                return
+            heapq.heappop(self._queues[job])
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self._granted += 1
+            future.set_result(None)
+            # Round-robin: the job goes to the back of the line
+            self._rotation.rotate(-1)
+
+    def _schedule(self, delay: float):
+        if self._timer is not None and not self._timer.cancelled():
+            return
+        loop = asyncio.get_running_loop()
+
+        def fire():
+            self._timer = None
+            self._dispatch()
+        self._timer = loop.call_later(delay, fire)
+
+    def refund(self, tokens: int, window: int = None):
+        """
+        Give back tokens reserved for a request that used fewer than estimated.
+        With a shared budget they go to window, by default the one the slot held
+        in this context took them from.
+        """
+        if tokens <= 0:
+            return
+        if self.shared is not None:
+            window = budget_window.get() if window is None else window
+            if window is not None:
+                # The Redis client is synchronous, keep the round trip off the event loop
+                asyncio.get_running_loop().run_in_executor(None, self._shared_refund, tokens, window)
+            return
+        self.tokens.refund(tokens)
+        self._dispatch()
+
+    def _shared_refund(self, tokens: int, window: int):
+        try:
+            self.shared.refund(tokens, window)
+        except Exception as e:
+            print(f"Could not refund {tokens} tokens to the shared LLM budget: {e}")
+
+    async def _take_shared(self, tokens: int) -> int | None:
+        """Window the tokens were taken from, None when the shared budget is unavailable."""
+        while True:
+            try:
+                wait, window = await asyncio.to_thread(self.shared.take, tokens)
+            except Exception as e:
+                # Redis being unreachable should not stop the LLM calls, the limiter still backs off on 429s
+                print(f"Shared LLM budget unavailable ({e}), proceeding without it")
+                return None
+            if wait <= 0:
+                return window
+            await asyncio.sleep(wait)
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 0):
+        """
+        Wait for admission, then hold a limiter slot. tokens is the estimated
+        prompt + completion size of the request, charged to the tokens/min budget.
+        Yields the shared budget window they were taken from (None without one),
+        also kept in budget_window for refund().
+        """
+        await self._admit(tokens)
+        window = None
+        try:
+            if self.shared is not None:
+                # Admitted requests keep their place while the shared budget refills
+                window = await self._take_shared(tokens)
+        except BaseException:
+            self._granted -= 1
+            self._dispatch()
+            raise
+        self._granted -= 1
+        budget_window.set(window)
+        async with self.limiter.slot():
+            yield window
@@ -0,0 +1,137 @@
+import os
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+import httpx
+
+INITIAL_CONCURRENCY = int(os.environ.get("LLM_INITIAL_CONCURRENCY", 4))
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 32))
+
+# A request slower than LATENCY_FACTOR x the usual latency counts as a sign of overload
+LATENCY_FACTOR = 2.0
+LATENCY_ALPHA = 0.1  # smoothing of the latency baseline
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """A request cut short by its job's deadline rather than by the provider's slowness."""
+
+
+def is_overload(exc: BaseException) -> bool:
+    """429s, 5xx responses and timeouts mean the provider wants less traffic (a job running out of time does not)."""
+    if isinstance(exc, DeadlineExceeded):
+        return False
+    if isinstance(exc, (httpx.TimeoutException, asyncio.TimeoutError)):
+        return True
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit for LLM requests that adapts to the provider (AIMD).
+
+    The limit grows by about one after every `limit` successful requests, is
+    halved on a 429, 5xx or timeout, and shrinks slightly when latency rises
+    well above its moving baseline. Requests over the limit wait in FIFO order.
+
+    Not bound to an event loop, so one instance can serve every job of a worker.
+    """
+    def __init__(self, initial: int = INITIAL_CONCURRENCY, minimum: int = MIN_CONCURRENCY, maximum: int = MAX_CONCURRENCY):
+        self.minimum = minimum
+        self.maximum = maximum
+        self._limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        self._waiters = deque()
+        self._latency = None  # moving baseline of successful request latency, seconds
+        self._last_decrease = 0.0
+        self._listeners = []
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for w in self._waiters if not w.done())
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "latency_baseline": round(self._latency, 3) if self._latency is not None else None,
+        }
+
+    def has_capacity(self) -> bool:
+        return self.in_flight < self.limit
+
+    def add_listener(self, callback):
+        """callback() runs whenever a slot is released, e.g. to admit queued work."""
+        self._listeners.append(callback)
+
+    async def acquire(self):
+        if self.has_capacity() and not self.queue_depth:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just before the cancellation
+                self.release()
+            raise
+
+    def release(self, latency: float = None, overloaded: bool = False):
+        self.in_flight -= 1
+        if overloaded:
+            self._decrease(0.5)
+        elif latency is not None:
+            self._observe(latency)
+        self._wake()
+        for callback in self._listeners:
+            callback()
+
+    def _observe(self, latency: float):
+        if self._latency is None:
+            self._latency = latency
+            return
+        if latency > self._latency * LATENCY_FACTOR:
+            self._decrease(0.9)
+        else:
+            self._limit = min(self.maximum, self._limit + 1 / self._limit)
+        self._latency += LATENCY_ALPHA * (latency - self._latency)
+
+    def _decrease(self, factor: float):
+        # Requests that were already in flight report the same overload; count it once
+        now = time.monotonic()
+        if now - self._last_decrease < (self._latency or 1.0):
+            return
+        self._last_decrease = now
+        self._limit = max(self.minimum, self._limit * factor)
+        print(f"LLM concurrency limit lowered to {self.limit}")
+
+    def _wake(self):
+        while self._waiters and self.has_capacity():
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue  # cancelled while waiting
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one request slot; the outcome of the block feeds the limit."""
+        await self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException as exc:
+            self.release(overloaded=is_overload(exc))
+            raise
+        self.release(latency=time.monotonic() - start)
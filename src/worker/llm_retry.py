@@ -0,0 +1,163 @@
+import os
+import time
+import random
+import asyncio
+import contextvars
+from collections import deque
+from contextlib import asynccontextmanager
+
+import httpx
+
+from llm_limiter import is_overload, DeadlineExceeded
+from llm_usage import record_retry, record_hedge
+
+REQUEST_TIMEOUT = float(os.environ.get("LLM_REQUEST_TIMEOUT", 90))  # seconds per attempt, queueing excluded
+MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 3))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+
+# Send a duplicate of a request still running after this percentile of recent
+# latencies (e.g. 95) and keep whichever answers first. 0 disables hedging.
+HEDGE_PERCENTILE = float(os.environ.get("LLM_HEDGE_PERCENTILE", 0))
+HEDGE_MIN_SAMPLES = 20
+
+# LLM time allowed per job; requests still running after it are given up. 0 disables the deadline.
+JOB_DEADLINE = float(os.environ.get("LLM_JOB_DEADLINE", 1800))
+
+job_deadline = contextvars.ContextVar("llm_job_deadline", default=None)
+
+
+def start_job_deadline():
+    """Start the deadline of the job running in the current context."""
+    job_deadline.set(time.monotonic() + JOB_DEADLINE if JOB_DEADLINE > 0 else None)
+
+
+def remaining_time() -> float | None:
+    deadline = job_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Failures that another attempt, or a later job, can get past: overload, timeouts, network errors."""
+    return isinstance(exc, (DeadlineExceeded, httpx.TransportError)) or is_overload(exc)
+
+
+def retry_delay(attempt: int, exc: BaseException) -> float:
+    """Full-jitter exponential backoff, or the provider's Retry-After when it sends one."""
+    response = getattr(exc, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(BACKOFF_MAX, float(retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+class LatencyTracker:
+    """Latencies of the most recent successful requests."""
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+
+    def record(self, latency: float):
+        self._samples.append(latency)
+
+    def percentile(self, p: float) -> float | None:
+        if len(self._samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def _check_deadline():
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded("job deadline passed")
+
+
+@asynccontextmanager
+async def attempt_timeout():
+    """
+    REQUEST_TIMEOUT, clipped to the job deadline. Running out of the deadline raises
+    DeadlineExceeded, which the limiter does not take for the provider being overloaded.
+    """
+    _check_deadline()
+    timeout = REQUEST_TIMEOUT
+    remaining = remaining_time()
+    by_deadline = remaining is not None and remaining < timeout
+    if by_deadline:
+        timeout = max(0.001, remaining)
+    try:
+        async with asyncio.timeout(timeout):
+            yield
+    except TimeoutError as exc:
+        if by_deadline and not isinstance(exc, DeadlineExceeded):
+            raise DeadlineExceeded("job deadline passed") from exc
+        raise
+
+
+async def _attempt(request, dispatcher, latencies: LatencyTracker = None, tokens: int = 0):
+    _check_deadline()
+    async with dispatcher.slot(tokens):
+        # Time spent waiting for a slot does not count against the request
+        start = time.monotonic()
+        async with attempt_timeout():
+            result = await request()
+    if latencies is not None:
+        latencies.record(time.monotonic() - start)
+    return result
+
+
+async def _hedged(request, dispatcher, latencies: LatencyTracker = None, tokens: int = 0):
+    delay = latencies.percentile(HEDGE_PERCENTILE) if HEDGE_PERCENTILE and latencies else None
+    primary = asyncio.ensure_future(_attempt(request, dispatcher, latencies, tokens))
+    if delay is None:
+        return await primary
+
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+    except asyncio.CancelledError:
+        # asyncio.wait does not cancel what it waits on
+        primary.cancel()
+        raise
+    # No hedging while the provider is already at the limit: the duplicate would only queue
+    if done or not dispatcher.has_capacity():
+        return await primary
+
+    record_hedge()
+    hedge = asyncio.ensure_future(_attempt(request, dispatcher, latencies, tokens))
+    pending = {primary, hedge}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+        raise primary.exception()
+    finally:
+        primary.cancel()
+        hedge.cancel()
+
+
+async def resilient_call(request, dispatcher, latencies: LatencyTracker = None, tokens: int = 0):
+    """
+    Await request() (a coroutine function doing one HTTP call) once admitted by
+    the dispatcher (tokens: estimated size of the request), with a timeout per attempt, retries with jittered exponential backoff
+    on transient errors and, with LLM_HEDGE_PERCENTILE set, a hedged duplicate
+    for attempts slower than that percentile of recent latencies.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return await _hedged(request, dispatcher, latencies, tokens)
+        except DeadlineExceeded:
+            raise
+        except Exception as exc:
+            if not is_transient(exc) or attempt == MAX_RETRIES:
+                raise
+            delay = retry_delay(attempt, exc)
+            remaining = remaining_time()
+            if remaining is not None and delay >= remaining:
+                raise DeadlineExceeded("job deadline passed") from exc
+            print(f"LLM request failed ({type(exc).__name__}: {exc}), retrying in {delay:.1f}s")
+            record_retry()
+            await asyncio.sleep(delay)
@@ -0,0 +1,79 @@
+import os
+import contextvars
+
+# USD per million tokens, used to put a price on the recorded usage
+PRICE_INPUT = float(os.environ.get("LLM_PRICE_INPUT", 0.27))
+PRICE_OUTPUT = float(os.environ.get("LLM_PRICE_OUTPUT", 1.10))
+
+current_usage = contextvars.ContextVar("llm_usage", default=())
+
+
+class Usage:
+    """LLM calls of a page or a job: tokens, time spent waiting for answers, retries and cache hits."""
+    FIELDS = ("requests", "cache_hits", "prompt_tokens", "completion_tokens", "truncated", "retries", "hedges", "latency")
+
+    def __init__(self, data: dict = None):
+        data = data or {}
+        for field in self.FIELDS:
+            setattr(self, field, data.get(field, 0))
+        self.pages = {}
+
+    @property
+    def cost(self) -> float:
+        return (self.prompt_tokens * PRICE_INPUT + self.completion_tokens * PRICE_OUTPUT) / 1_000_000
+
+    def add(self, other: "Usage"):
+        for field in self.FIELDS:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    def page(self, page_num: int, data: dict = None) -> "Usage":
+        """Usage of one page of the job, counted in the job's totals as well."""
+        page = Usage(data)
+        if data:
+            self.add(page)
+        self.pages[page_num] = page
+        return page
+
+    def to_dict(self) -> dict:
+        data = {field: getattr(self, field) for field in self.FIELDS}
+        data["latency"] = round(self.latency, 3)
+        data["cost"] = round(self.cost, 6)
+        if self.pages:
+            data["pages"] = {str(n): page.to_dict() for n, page in sorted(self.pages.items())}
+        return data
+
+    def __str__(self) -> str:
+        return (
+            f"{self.requests} requests ({self.cache_hits} cached, {self.retries} retries, {self.truncated} truncated), "
+            f"{self.prompt_tokens} prompt + {self.completion_tokens} completion tokens, "
+            f"{self.latency:.1f}s, ${self.cost:.4f}"
+        )
+
+
+def track(*usages: Usage):
+    """Count the LLM calls made from the current context in usages (e.g. the page's and the job's)."""
+    current_usage.set(usages)
+
+
+def record_call(usage: dict | None, latency: float, cached: bool = False, finish_reason: str = None):
+    """One answered LLM request; usage is the provider's usage block of the answer."""
+    for target in current_usage.get():
+        target.requests += 1
+        target.latency += latency
+        if finish_reason == "length":
+            target.truncated += 1
+        if cached:
+            target.cache_hits += 1
+        elif usage:
+            target.prompt_tokens += usage.get("prompt_tokens", 0)
+            target.completion_tokens += usage.get("completion_tokens", 0)
+
+
+def record_retry():
+    for target in current_usage.get():
+        target.retries += 1
+
+
+def record_hedge():
+    for target in current_usage.get():
+        target.hedges += 1
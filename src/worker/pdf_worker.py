@@ -1,19 +1,24 @@
-import os, time, json, tempfile, requests, asyncio
+import os, time, json, tempfile, requests, asyncio, random, threading, hashlib
 from upstash_redis import Redis
 import psycopg2, psycopg2.extras
-import fitz
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
-from text_extractor import TextExtractor
-from image_extractor import ImageExtractor
-from table_extractor import TableExtractor
-from llm_cleaner import components_from_chunks
-from embedding_service import EmbeddingService
-from image_upload_service import ImageUploadService
+from text_extractor import TextExtractor, TEXT_PROCESSES, PARALLEL_MIN_PAGES, set_size_ratios, body_font_size
+from document_context import DocumentContext
+from llm_cleaner import components_from_chunks, stream_components, llm_limiter, llm_dispatcher, llm_cache, close_llm_client
+from llm_retry import start_job_deadline
+from llm_dispatch import set_job, set_priority, SharedBudget, HOST_RPM, HOST_TPM
+from llm_usage import Usage, track
+from worker_pool import rss_mb
+from job_queue import JobQueue, RECOVER_INTERVAL
+from checkpoint_store import CheckpointStore
+from repeated_blocks import find_repeated, drop_repeated, sample_pages
 import re
 
 NULL_RE = re.compile(r'\u0000')
@@ -31,28 +36,192 @@ def safe_json(obj:dict) -> str:
     clean = strip_nul(obj)
     return json.dumps(clean, ensure_ascii=False)
 
-redis = Redis(
-    url=os.environ["UPSTASH_REDIS_REST_URL"],
-    token=os.environ["UPSTASH_REDIS_REST_TOKEN"]
-)
+# One pooled session so downloads reuse connections between jobs
+http = requests.Session()
+http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+http.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
 
-conn = psycopg2.connect(os.environ["DATABASE_URL"])
-cursor = conn.cursor()
+MAX_DOWNLOAD_BYTES = int(os.environ.get("MAX_PDF_MB", 200)) * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_RETRIES = 3
 
-# Extractors
-text_extractor = TextExtractor()
-image_extractor = ImageExtractor()
-table_extractor = TableExtractor()
-embedding_service = EmbeddingService()
-image_upload_service = ImageUploadService()
+# Poll right away while jobs keep coming, back off up to POLL_MAX_DELAY when idle
+POLL_MIN_DELAY = 0.05
+POLL_MAX_DELAY = 2.0
 
-def download_blob(url: str) -> str:
-    response = requests.get(url, timeout=30)
-    response.raise_for_status()
+# Connections, models and services, created by init_worker() rather than on import: the text
+# extraction processes are spawned and re-import the main module, and must not open any of these.
+# The modules behind the models (layoutparser, sentence-transformers) are imported there too,
+# so a spawned process only loads the text extractor and the light LLM and queue modules
+redis = job_queue = conn = cursor = checkpoints = None
+text_extractor = image_extractor = table_extractor = None
+embedding_service = image_upload_service = None
+
+def init_worker():
+    global redis, job_queue, conn, cursor, checkpoints
+    global text_extractor, image_extractor, table_extractor, embedding_service, image_upload_service
+    if job_queue is not None:
+        return
+    redis = Redis(
+        url=os.environ["UPSTASH_REDIS_REST_URL"],
+        token=os.environ["UPSTASH_REDIS_REST_TOKEN"]
+    )
+    job_queue = JobQueue(redis, "pdf_jobs")
+    if HOST_RPM or HOST_TPM:
+        # One LLM rate budget for every worker process and host, kept in Redis
+        llm_dispatcher.use_shared_budget(SharedBudget(redis))
+
+    conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    cursor = conn.cursor()
+    checkpoints = CheckpointStore(cursor)
+
+    from image_extractor import ImageExtractor
+    from table_extractor import TableExtractor
+    from embedding_service import EmbeddingService
+    from image_upload_service import ImageUploadService
+
+    # Extractors
+    text_extractor = TextExtractor()
+    image_extractor = ImageExtractor()
+    table_extractor = TableExtractor()
+    embedding_service = EmbeddingService()
+    image_upload_service = ImageUploadService()
+
+# Every job runs on this one event loop so the shared LLM client keeps its connections
+event_loop = asyncio.Runner()
+
+# "streaming": send each page to the LLM as soon as it is extracted; "phased": extract every page first
+PIPELINE_MODE = os.environ.get("PDF_PIPELINE_MODE", "streaming")
+
+# Stream LLM answers and store components while the model is still writing them
+STREAM_COMPONENTS = os.environ.get("LLM_STREAM", "0") == "1"
+# A streamed page is written out every STREAM_FLUSH_COMPONENTS components or STREAM_FLUSH_SECONDS
+STREAM_FLUSH_COMPONENTS = 20
+STREAM_FLUSH_SECONDS = 1.0
+
+# Drop text blocks repeated across pages (running headers, footers, page numbers) before the LLM
+DROP_REPEATED_BLOCKS = os.environ.get("PDF_DROP_REPEATED", "1") == "1"
+
+def download_blob(url: str) -> tuple[str, str]:
+    """
+    Stream the PDF into a temp file in fixed-size chunks, hashing it on the way.
+    Interrupted downloads resume from the last received byte when the server
+    supports range requests. Returns (temp_path, sha256 hex digest).
+    """
     file_descriptor, temp_path = tempfile.mkstemp(suffix=".pdf")
-    with open(file_descriptor, "wb") as temp_file:
-        temp_file.write(response.content)
-    return temp_path
+    sha256 = hashlib.sha256()
+    written = 0
+    try:
+        with open(file_descriptor, "wb") as temp_file:
+            for attempt in range(1, DOWNLOAD_RETRIES + 1):
+                # identity encoding so byte offsets match what the server stores
+                headers = {"Accept-Encoding": "identity"}
+                if written:
+                    headers["Range"] = f"bytes={written}-"
+                try:
+                    with http.get(url, headers=headers, stream=True, timeout=(10, 30)) as response:
+                        if written and response.status_code == 416:
+                            # Everything had already arrived before the connection dropped
+                            break
+                        response.raise_for_status()
+                        if written and response.status_code != 206:
+                            # Server ignored the range, start over
+                            temp_file.seek(0)
+                            temp_file.truncate()
+                            sha256 = hashlib.sha256()
+                            written = 0
+
+                        expected = int(response.headers.get("Content-Length", 0)) + written
+                        if expected > MAX_DOWNLOAD_BYTES:
+                            raise ValueError(f"PDF is {expected} bytes, limit is {MAX_DOWNLOAD_BYTES}")
+
+                        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            written += len(chunk)
+                            if written > MAX_DOWNLOAD_BYTES:
+                                raise ValueError(f"PDF is larger than the limit of {MAX_DOWNLOAD_BYTES} bytes")
+                            temp_file.write(chunk)
+                            sha256.update(chunk)
+                    break
+                except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                    if attempt == DOWNLOAD_RETRIES:
+                        raise
+                    print(f"Download interrupted after {written} bytes ({e}), retrying...")
+                    time.sleep(attempt)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return temp_path, sha256.hexdigest()
+
+def read_page_texts(doc: DocumentContext, page_numbers: list) -> dict:
+    """Text blocks of the given pages as {page: blocks}, read by several processes for long documents."""
+    if TEXT_PROCESSES > 1 and len(page_numbers) >= PARALLEL_MIN_PAGES:
+        return text_extractor.extract_pages(doc.path, page_numbers)
+    texts = {}
+    for page_num in page_numbers:
+        texts[page_num] = text_extractor.extract_page(doc, page_num)
+        # Only the blocks are kept until the page is processed, not its parsed text
+        doc.page(page_num).release()
+    return texts
+
+def extract_page_objects(doc: DocumentContext, page_num: int, page_text: list = None, repeated: set = None,
+                         body_size: float = None) -> tuple[list, list, list]:
+    """
+    Run every extractor on one page (text only if page_text is not given) and upload its images and tables.
+    Text blocks read here get font sizes relative to body_size, the document's body text, and are
+    dropped when their signature is in repeated.
+    """
+    if page_text is None:
+        page_text = text_extractor.extract_page(doc, page_num)
+        set_size_ratios(page_text, body_size)
+        page_text = drop_repeated(page_text, repeated, doc.page_dims.get(page_num))
+    page_images = image_extractor.extract_page(doc, page_num)
+    page_tables = table_extractor.extract_page(doc, page_num)
+    # Everything this page needed has been extracted
+    doc.page(page_num).release()
+
+    print(f"Page {page_num}: extracted {len(page_text)} text, {len(page_images)} image, {len(page_tables)} table objects.")
+    for obj in page_images + page_tables:
+        print(f"  type={obj['type']} page={obj.get('page')} filename={obj.get('filename')} group_id={obj.get('group_id', None)}")
+
+    # Upload images and tables to CDN
+    if page_images or page_tables:
+        uploaded_objects = image_upload_service.upload_images_batch(page_images + page_tables)
+
+        # Separate back into images and tables
+        page_images = [obj for obj in uploaded_objects if obj.get('type') == 'image']
+        page_tables = [obj for obj in uploaded_objects if obj.get('type') == 'table']
+
+    return page_text, page_images, page_tables
+
+def store_vision_objects(job_name: str, vision_objects: list, page_dims: dict):
+    """Store image and table objects with their page dimensions"""
+    if not vision_objects:
+        return
+    for obj in vision_objects:
+        if "page_width" not in obj:
+            w, h = page_dims.get(obj["page"], (612, 792))
+            obj["page_width"] = w
+            obj["page_height"] = h
+    psycopg2.extras.execute_values(
+        cursor,
+        """ 
+        INSERT INTO pdf_objects (file, page, type, content, bbox, page_width, page_height)
+        VALUES %s
+        """,
+        [
+            (
+                job_name,
+                obj["page"],
+                obj["type"],
+                safe_json(obj), # Store the whole object in content
+                json.dumps(obj.get("bbox", [])),
+                obj["page_width"],
+                obj["page_height"],
+            )
+            for obj in vision_objects
+        ],
+    )
+    print(f"Stored {len(vision_objects)} vision objects.")
 
 async def process_page_async(
     page_num: int,
@@ -61,46 +230,296 @@ async def process_page_async(
     page_tables: list,
     job_name: str,
     page_dims: dict,
-    semaphore: asyncio.Semaphore
+    usage: Usage
 ):
     """Process a single page asynchronously"""
-    async with semaphore:  # Limit concurrent LLM calls
-        if not page_text:
-            print(f"Skipping page {page_num} (no text content).")
-            return None
+    # Earlier pages are answered first when requests queue up
+    set_priority(page_num)
+    # LLM calls of this page count for the page and for the job
+    page_usage = usage.page(page_num)
+    track(page_usage, usage)
+    if not page_text:
+        print(f"Skipping page {page_num} (no text content).")
+        checkpoints.save(job_name, "page", page_num, page_usage.to_dict())
+        conn.commit()
+        return None
 
-        print(f"Processing page {page_num} through LLM...")
-        
-        # Get components for this page only
-        page_components = await components_from_chunks(page_text, page_images, page_tables)
-        
-        # Filter out titles from pages other than page 1
-        if page_num > 1:
-            page_components = [comp for comp in page_components if comp.get('component') != 'Title']
-        
-        if page_components:
-            # Store components with page number
-            cursor.execute(
-                """
-                INSERT INTO pdf_objects (file, page, type, content, bbox, page_width, page_height)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """,
-                (
-                    job_name,
-                    page_num,
-                    "components",
-                    json.dumps({"components": page_components}),
-                    json.dumps([0, 0, 0, 0]), # Placeholder bbox
-                    page_dims.get(page_num, (612, 792))[0],
-                    page_dims.get(page_num, (612, 792))[1],
-                )
-            )
-            print(f"Stored {len(page_components)} components for page {page_num}.")
-            
+    print(f"Processing page {page_num} through LLM...")
+
+    if STREAM_COMPONENTS:
+        page_components = await stream_page_components(page_num, page_text, page_images, page_tables, job_name, page_dims)
+        checkpoints.save(job_name, "page", page_num, page_usage.to_dict())
+        conn.commit()
         return page_components
 
+    # Get components for this page only
+    page_components = await components_from_chunks(page_text, page_images, page_tables, page_dims.get(page_num))
+    
+    # Filter out titles from pages other than page 1
+    if page_num > 1:
+        page_components = [comp for comp in page_components if comp.get('component') != 'Title']
+    
+    if page_components:
+        store_components(job_name, page_num, page_components, page_dims)
+        print(f"Stored {len(page_components)} components for page {page_num}.")
+
+    print(f"Page {page_num} LLM usage: {page_usage}")
+    checkpoints.save(job_name, "page", page_num, page_usage.to_dict())
+    conn.commit()
+    return page_components
+
+def store_components(job_name: str, page_num: int, components: list, page_dims: dict):
+    """Store components with page number"""
+    cursor.execute(
+        """
+        INSERT INTO pdf_objects (file, page, type, content, bbox, page_width, page_height)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """,
+        (
+            job_name,
+            page_num,
+            "components",
+            json.dumps({"components": components}),
+            json.dumps([0, 0, 0, 0]), # Placeholder bbox
+            page_dims.get(page_num, (612, 792))[0],
+            page_dims.get(page_num, (612, 792))[1],
+        )
+    )
+
+async def stream_page_components(
+    page_num: int,
+    page_text: list,
+    page_images: list,
+    page_tables: list,
+    job_name: str,
+    page_dims: dict
+) -> list:
+    """
+    Run a page through the LLM in streaming mode, committing its components in
+    several rows as they arrive so the viewer can show them before the page is done.
+    """
+    # Rows left by an earlier attempt that stopped partway through this page
+    cursor.execute(
+        "DELETE FROM pdf_objects WHERE file = %s AND page = %s AND type = 'components'",
+        (job_name, page_num)
+    )
+    page_components = []
+    pending = []
+    flushed_at = time.monotonic()
+    async for comp in stream_components(page_text, page_images, page_tables, page_dims.get(page_num)):
+        # Filter out titles from pages other than page 1
+        if page_num > 1 and comp.get('component') == 'Title':
+            continue
+        page_components.append(comp)
+        pending.append(comp)
+        if len(pending) >= STREAM_FLUSH_COMPONENTS or time.monotonic() - flushed_at >= STREAM_FLUSH_SECONDS:
+            store_components(job_name, page_num, pending, page_dims)
+            conn.commit()
+            pending = []
+            flushed_at = time.monotonic()
+    if pending:
+        store_components(job_name, page_num, pending, page_dims)
+    print(f"Stored {len(page_components)} components for page {page_num}.")
+    return page_components
+
+def load_stored_components(job_name: str) -> dict:
+    """Components already stored for a file, as {page: components}."""
+    cursor.execute(
+        "SELECT page, content FROM pdf_objects WHERE file = %s AND type = 'components' ORDER BY page, id",
+        (job_name,)
+    )
+    stored = defaultdict(list)
+    for page_num, content in cursor.fetchall():
+        stored[page_num].extend(content.get("components", []))
+    return stored
+
+async def process_document(job: dict, doc: DocumentContext, vision_objects: list, done: dict, usage: Usage) -> list:
+    """
+    Extract, store and run every page of the document through the LLM.
+
+    In streaming mode a page goes to the LLM as soon as its own extraction is done,
+    while the following pages are still being extracted. In phased mode every page
+    is extracted before the first LLM call. Extracted images and tables are added
+    to vision_objects so the caller can clean up their local files.
+
+    done holds the checkpoints of an earlier attempt: finished pages are read back
+    from pdf_objects and pages that were already extracted skip extraction and upload.
+    The LLM usage of every page, earlier attempts included, is added to usage.
+    """
+    num_pages = len(doc)
+    page_dims = doc.page_dims
+    loop = asyncio.get_running_loop()
+    # LLM requests of every page task created below share this job's deadline and queue
+    start_job_deadline()
+    set_job(job["name"])
+    stored_components = load_stored_components(job["name"]) if done else {}
+
+    def finished(page_num):
+        usage.page(page_num, done[("page", page_num)])
+        future = loop.create_future()
+        future.set_result(stored_components.get(page_num))
+        return future
+
+    def extract(page_num, page_text=None):
+        extracted = done.get(("extract", page_num))
+        if extracted is not None:
+            print(f"Page {page_num}: reusing extraction from an earlier attempt.")
+            future = loop.create_future()
+            future.set_result((extracted["text"], extracted["images"], extracted["tables"]))
+            return future
+        return loop.run_in_executor(extraction_pool, extract_page_objects, doc, page_num, page_text, repeated, body_size)
+
+    def start_page(page_num, page_objects):
+        page_text, page_images, page_tables = page_objects
+        if ("extract", page_num) not in done:
+            vision_objects.extend(page_images + page_tables)
+            store_vision_objects(job["name"], page_images + page_tables, page_dims)
+            checkpoints.save(job["name"], "extract", page_num, {
+                "text": strip_nul(page_text),
+                "images": strip_nul(page_images),
+                "tables": strip_nul(page_tables),
+            })
+            conn.commit()
+        return asyncio.create_task(process_page_async(
+            page_num,
+            page_text,
+            page_images,
+            page_tables,
+            job["name"],
+            page_dims,
+            usage
+        ))
+
+    # fitz documents must not be used from several threads at once, so all
+    # extraction runs on one thread next to the event loop driving the LLM calls
+    tasks = []
+    try:
+        with ThreadPoolExecutor(max_workers=1) as extraction_pool:
+            pending = [n for n in range(1, num_pages + 1) if ("page", n) not in done]
+            if len(pending) < num_pages:
+                print(f"Resuming: {num_pages - len(pending)} of {num_pages} pages were finished by an earlier attempt.")
+
+            texts = {}
+            repeated = set()
+            body_size = None
+            to_extract = [n for n in pending if ("extract", n) not in done]
+            if to_extract:
+                # The body font size and repeated blocks are found from a bounded sample of the pages, so
+                # streaming still starts after a few pages and a resumed job does not read its finished
+                # pages again. In phased mode the text of every page to extract is read up front too (by
+                # several processes for long documents); in streaming mode the remaining pages are read
+                # as they are reached
+                sample = sample_pages(num_pages)
+                page_numbers = sorted(set(sample) | (set(to_extract) if PIPELINE_MODE != "streaming" else set()))
+                texts = await loop.run_in_executor(extraction_pool, read_page_texts, doc, page_numbers)
+                # Font sizes are compared with the body text of the document rather than of each page,
+                # on the pages read here and on those extract_page_objects reads later
+                body_size = body_font_size([block for blocks in texts.values() for block in blocks])
+                for blocks in texts.values():
+                    set_size_ratios(blocks, body_size)
+                if DROP_REPEATED_BLOCKS:
+                    repeated = find_repeated({n: texts[n] for n in sample}, page_dims)
+                    if repeated:
+                        print(f"Dropping {len(repeated)} blocks repeated across pages (headers, footers, page numbers).")
+                texts = {n: drop_repeated(texts[n], repeated, page_dims.get(n)) for n in to_extract if n in texts}
+
+            if PIPELINE_MODE == "streaming":
+                for page_num in range(1, num_pages + 1):
+                    if page_num not in pending:
+                        tasks.append(finished(page_num))
+                        continue
+                    page_objects = await extract(page_num, texts.get(page_num))
+                    tasks.append(start_page(page_num, page_objects))
+            else:
+                extracted = {page_num: await extract(page_num, texts.get(page_num)) for page_num in pending}
+                for page_num in range(1, num_pages + 1):
+                    if page_num not in pending:
+                        tasks.append(finished(page_num))
+                    else:
+                        tasks.append(start_page(page_num, extracted[page_num]))
+    except BaseException:
+        # The event loop outlives the job: pages already started must not run on into the next one
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    # Wait for all pages to complete
+    print(f"Waiting for {len(tasks)} pages...")
+    page_results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Collect all components and handle any exceptions
+    all_components = []
+    for i, result in enumerate(page_results):
+        page_num = i + 1
+        if isinstance(result, Exception):
+            print(f"Error processing page {page_num}: {result}")
+        elif result is not None:
+            all_components.extend(result)
+
+    print(f"LLM limiter: {llm_limiter.stats()}")
+    print(f"LLM dispatcher: {llm_dispatcher.stats()}")
+    print(f"LLM cache: {llm_cache.stats()}")
+    print(f"LLM usage of {job['name']}: {usage}")
+    return all_components
+
+def find_processed_file(content_hash: str, job_name: str) -> str | None:
+    """Key of a successfully processed file with the same content, if any."""
+    cursor.execute(
+        """
+        SELECT "key" FROM "File"
+        WHERE "contentHash" = %s AND "uploadStatus" = 'SUCCESS' AND "key" <> %s
+        ORDER BY "updatedAt" DESC
+        LIMIT 1
+        """,
+        (content_hash, job_name)
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def clone_processed_file(source_key: str, job_name: str):
+    """Copy the pdf_objects rows and embeddings of source_key to job_name."""
+    cursor.execute("DELETE FROM pdf_objects WHERE file = %s", (job_name,))
+    cursor.execute(
+        """
+        INSERT INTO pdf_objects (file, page, type, content, bbox, page_width, page_height)
+        SELECT %s, page, type, content, bbox, page_width, page_height
+        FROM pdf_objects WHERE file = %s
+        ORDER BY id
+        """,
+        (job_name, source_key)
+    )
+    print(f"Cloned {cursor.rowcount} objects from {source_key}.")
+
+    chunk_count = embedding_service.clone_embeddings(source_key, job_name)
+    if chunk_count is None:
+        # The source collection lives on another worker host: re-embed the cloned components locally (no LLM calls)
+        cursor.execute(
+            "SELECT content FROM pdf_objects WHERE file = %s AND type = 'components' ORDER BY page, id",
+            (job_name,)
+        )
+        components = [c for (content,) in cursor.fetchall() for c in content.get("components", [])]
+        create_component_embeddings(job_name, components)
+    else:
+        print(f"Cloned embeddings: {chunk_count} chunks.")
+
+def create_component_embeddings(job_name: str, components: list):
+    """Create embeddings from a simple text representation of all components"""
+    if not components:
+        return
+    # Create a simple string representation for embedding
+    html_content_for_embedding = "\n".join([c['props'].get('text', '') for c in components if 'text' in c['props']])
+    print("Creating embeddings...")
+    embedding_info = embedding_service.create_embeddings(
+        file_name=job_name,
+        content=html_content_for_embedding
+    )
+    print(f"Embeddings created: {embedding_info.get('chunk_count')} chunks.")
+
 def process_job(job:dict):
     pdf_path = None
+    vision_objects = []
+    usage = Usage()
     try:
         print("Processing:", job["name"])
         
@@ -111,177 +530,116 @@ def process_job(job:dict):
         )
         conn.commit()
         
-        pdf_path = download_blob(job["url"])
+        # Checkpoints left by an earlier attempt of this job, if any
+        done = checkpoints.load(job["name"])
+        downloaded = done.get(("download", 0))
+        source_key = None
 
-        # Extract all objects from the PDF
-        text_objects = text_extractor.extract(pdf_path)
-        image_objects = image_extractor.extract(pdf_path)
-        table_objects = table_extractor.extract(pdf_path)
-        
-        print(f"Extracted: {len(text_objects)} text, {len(image_objects)} image, {len(table_objects)} table objects.")
-        print("Image objects extracted:")
-        for img in image_objects:
-            print(f"  id={img.get('id', img.get('filename'))} page={img.get('page')} filename={img.get('filename')} group_id={img.get('group_id', None)}")
-        print("Table objects extracted:")
-        for tbl in table_objects:
-            print(f"  id={tbl.get('id', tbl.get('filename'))} page={tbl.get('page')} filename={tbl.get('filename')} group_id={tbl.get('group_id', None)}")
-
-        # Upload images and tables to CDN
-        if image_objects or table_objects:
-            print("Uploading images and tables to CDN...")
-            all_vision_objects = image_objects + table_objects
-            uploaded_objects = image_upload_service.upload_images_batch(all_vision_objects)
-            
-            # Separate back into images and tables
-            image_objects = [obj for obj in uploaded_objects if obj.get('type') == 'image']
-            table_objects = [obj for obj in uploaded_objects if obj.get('type') == 'table']
-            
-            print(f"Uploaded {len([img for img in image_objects if 'cdn_url' in img])} images")
-            print(f"Uploaded {len([table for table in table_objects if 'cdn_url' in table])} tables")
-
-        # Group all extracted objects by their page number
-        text_by_page = defaultdict(list)
-        images_by_page = defaultdict(list)
-        tables_by_page = defaultdict(list)
-
-        for obj in text_objects:
-            text_by_page[obj.get('page', 1)].append(obj)
-        for obj in image_objects:
-            images_by_page[obj.get('page', 1)].append(obj)
-        for obj in table_objects:
-            tables_by_page[obj.get('page', 1)].append(obj)
-
-        # Get page dimensions and number of pages
-        doc = fitz.open(pdf_path)
-        num_pages = len(doc)
-        page_dims = {i + 1: (p.rect.width, p.rect.height) for i, p in enumerate(doc)}
-        doc.close()
-
-        # Process pages concurrently with asyncio
-        async def process_all_pages():
-            # Create a semaphore to limit concurrent LLM calls
-            semaphore = asyncio.Semaphore(3)  # Process up to 3 pages concurrently
-            
-            # Create tasks for all pages
-            tasks = []
-            for page_num in range(1, num_pages + 1):
-                page_text = text_by_page.get(page_num, [])
-                page_images = images_by_page.get(page_num, [])
-                page_tables = tables_by_page.get(page_num, [])
-                
-                task = process_page_async(
-                    page_num, 
-                    page_text, 
-                    page_images, 
-                    page_tables, 
-                    job["name"], 
-                    page_dims, 
-                    semaphore
-                )
-                tasks.append(task)
-            
-            # Wait for all pages to complete
-            print(f"Processing {len(tasks)} pages concurrently...")
-            page_results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            # Collect all components and handle any exceptions
-            all_components = []
-            for i, result in enumerate(page_results):
-                page_num = i + 1
-                if isinstance(result, Exception):
-                    print(f"Error processing page {page_num}: {result}")
-                elif result is not None:
-                    all_components.extend(result)
-            
-            return all_components
-        
-        # Run the async processing
-        all_components = asyncio.run(process_all_pages())
-
-        # Create embeddings from a simple text representation of all components
-        if all_components:
-            # Create a simple string representation for embedding
-            html_content_for_embedding = "\n".join([c['props'].get('text', '') for c in all_components if 'text' in c['props']])
-            print("Creating embeddings...")
-            embedding_info = embedding_service.create_embeddings(
-                file_name=job["name"],
-                content=html_content_for_embedding
-            )
-            print(f"Embeddings created: {embedding_info.get('chunk_count')} chunks.")
+        if downloaded and all(("page", n) in done for n in range(1, downloaded["page_count"] + 1)):
+            # Every page was finished before, the PDF itself is not needed anymore
+            print("All pages were finished by an earlier attempt, skipping download and extraction.")
+            content_hash = downloaded["content_hash"]
+            for page_num in range(1, downloaded["page_count"] + 1):
+                usage.page(page_num, done[("page", page_num)])
+            stored_components = load_stored_components(job["name"])
+            all_components = [c for page_num in sorted(stored_components) for c in stored_components[page_num]]
+        else:
+            pdf_path, content_hash = download_blob(job["url"])
 
-        # 7. Store vision objects with correct page numbers
-        vision_objects = image_objects + table_objects
-        if vision_objects:
-            for obj in vision_objects:
-                if "page_width" not in obj:
-                    w, h = page_dims.get(obj["page"], (612, 792))
-                    obj["page_width"] = w
-                    obj["page_height"] = h
-            print("Inserting vision objects into DB:")
-            for obj in vision_objects:
-                print(f"  type={obj['type']} id={obj.get('id', obj.get('filename'))} page={obj['page']} filename={obj.get('filename')} group_id={obj.get('group_id', None)}")
-            psycopg2.extras.execute_values(
-                cursor,
-                """ 
-                INSERT INTO pdf_objects (file, page, type, content, bbox, page_width, page_height)
-                VALUES %s
-                """,
-                [
-                    (
-                        job["name"],
-                        obj["page"],
-                        obj["type"],
-                        safe_json(obj), # Store the whole object in content
-                        json.dumps(obj.get("bbox", [])),
-                        obj["page_width"],
-                        obj["page_height"],
-                    )
-                    for obj in vision_objects
-                ],
-            )
-            print(f"Stored {len(vision_objects)} vision objects.")
+            source_key = find_processed_file(content_hash, job["name"])
+            if source_key:
+                # Same bytes were processed before: reuse those results instead of running the pipeline
+                print(f"Identical PDF already processed as {source_key}, reusing its results")
+                clone_processed_file(source_key, job["name"])
+            else:
+                # Open the PDF once and share it (and its parsed pages) with every extractor
+                with DocumentContext(pdf_path) as doc:
+                    checkpoints.save(job["name"], "download", 0, {"content_hash": content_hash, "page_count": len(doc)})
+                    conn.commit()
+                    all_components = event_loop.run(process_document(job, doc, vision_objects, done, usage))
 
-        # Update file status to success
+        if not source_key and ("embeddings", 0) not in done:
+            create_component_embeddings(job["name"], all_components)
+            checkpoints.save(job["name"], "embeddings")
+            conn.commit()
+
+        # Update file status to success and index its content for later re-uploads
         cursor.execute(
-            "UPDATE \"File\" SET \"uploadStatus\" = 'SUCCESS' WHERE \"key\" = %s",
-            (job["name"],)
+            "UPDATE \"File\" SET \"uploadStatus\" = 'SUCCESS', \"contentHash\" = %s, \"processingStats\" = %s WHERE \"key\" = %s",
+            (content_hash, json.dumps(usage.to_dict()), job["name"])
         )
+        checkpoints.clear(job["name"])
         conn.commit()
         print("Successfully processed", job["name"])
 
     except Exception as e:
         print(f"Error processing {job['name']}: {str(e)}")
-        # Update file status to failed
+        # Keep what earlier transactions committed (checkpoints), drop the failed one
+        conn.rollback()
+        # Update file status to failed, keeping what the attempt cost
         cursor.execute(
-            "UPDATE \"File\" SET \"uploadStatus\" = 'FAILED' WHERE \"key\" = %s",
-            (job["name"],)
+            "UPDATE \"File\" SET \"uploadStatus\" = 'FAILED', \"processingStats\" = %s WHERE \"key\" = %s",
+            (json.dumps(usage.to_dict()), job["name"])
         )
         conn.commit()
         raise
     finally:
         if pdf_path and os.path.exists(pdf_path):
             os.remove(pdf_path)
-        if 'image_objects' in locals() and (image_objects or table_objects):
-            all_vision_objects = image_objects + table_objects
-            image_upload_service.cleanup_local_files(all_vision_objects)
+        if vision_objects:
+            image_upload_service.cleanup_local_files(vision_objects)
     
     print("Done: ", job["name"])
 
-def main():
-    print("PDF Worker started - waiting for jobs...")
-    while True:
-        try:
-            job_json = redis.rpop("pdf_jobs")
-            if job_json is None:
-                time.sleep(2)
-                continue
-            
-            print("Found job! Processing...")
-            process_job(json.loads(job_json))
-            
-        except Exception as e:
-            print(f"Error in main loop: {str(e)}")
-            time.sleep(5)
+def main(max_rss_mb: float = None, stop_event=None):
+    """
+    Claim and process jobs until stop_event is set.
+    With max_rss_mb the worker returns once its memory goes over the limit so a
+    supervisor (see worker_pool.py) can start a fresh process.
+    """
+    init_worker()
+    print(f"PDF Worker {job_queue.worker_id} started - waiting for jobs...")
+    stop_event = stop_event or threading.Event()
+    poll_delay = POLL_MIN_DELAY
+    next_recover = 0.0
+    try:
+        while not stop_event.is_set():
+            if max_rss_mb:
+                rss = rss_mb()
+                if rss is not None and rss > max_rss_mb:
+                    print(f"Worker uses {rss:.0f} MB (limit {max_rss_mb:.0f} MB), exiting for restart")
+                    return
+            try:
+                if time.monotonic() >= next_recover:
+                    job_queue.recover_expired()
+                    next_recover = time.monotonic() + RECOVER_INTERVAL
+
+                job_json = job_queue.claim()
+                if job_json is None:
+                    # Back off while the queue stays empty, with jitter so workers don't poll in lockstep
+                    stop_event.wait(poll_delay * random.uniform(0.5, 1.0))
+                    poll_delay = min(poll_delay * 2, POLL_MAX_DELAY)
+                    continue
+                # Under load the next job is claimed right away
+                poll_delay = POLL_MIN_DELAY
+
+                print("Found job! Processing...")
+                with job_queue.lease(job_json):
+                    try:
+                        process_job(json.loads(job_json))
+                    except Exception as e:
+                        job_queue.fail(job_json, str(e))
+                        raise
+                job_queue.ack(job_json)
+
+            except Exception as e:
+                print(f"Error in main loop: {str(e)}")
+                stop_event.wait(5)
+    finally:
+        job_queue.close()
+        text_extractor.close()
+        event_loop.run(close_llm_client())
+        event_loop.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,80 @@
+"""
+Running headers, footers, page numbers and conference banners repeat on most
+pages of a document. They are found by hashing each text block's normalized
+text together with its position on the page, quantized so small layout
+differences between pages do not matter. A signature seen on enough pages is
+page furniture: its blocks are dropped before the text goes to the LLM.
+"""
+import re
+import hashlib
+
+# A block counts as repeated when it appears on at least this share of the
+# pages (0.4 so headers alternating between left and right pages qualify),
+# and on no fewer than REPEAT_MIN_PAGES pages
+REPEAT_MIN_FRACTION = 0.4
+REPEAT_MIN_PAGES = 3
+# Positions are rounded to this fraction of the page size
+POSITION_QUANTUM = 0.02
+# Repeats are found from a sample of the pages so the rest can be streamed: the first
+# REPEAT_SAMPLE_HEAD pages and REPEAT_SAMPLE_SPREAD more spread through the document
+REPEAT_SAMPLE_HEAD = 6
+REPEAT_SAMPLE_SPREAD = 4
+# Numbers are masked in blocks up to this many words ("Page 3", "12 Methods"), longer ones must repeat verbatim
+MASK_NUMBERS_MAX_WORDS = 6
+
+_DIGITS = re.compile(r"\d+")
+
+
+def normalize(text: str) -> str:
+    """Lowercased text with whitespace collapsed and, in short blocks, numbers masked so "Page 3" and "Page 4" match."""
+    words = text.lower().split()
+    text = " ".join(words)
+    return _DIGITS.sub("#", text) if len(words) <= MASK_NUMBERS_MAX_WORDS else text
+
+
+def block_signature(block: dict, page_size: tuple) -> tuple | None:
+    """(text hash, quantized top, bottom and horizontal center) of a text block, None without a bbox."""
+    bbox = block.get("bbox")
+    text = normalize(block.get("content", ""))
+    if not bbox or not page_size or not text:
+        return None
+    width, height = page_size
+    digest = hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+    # The center rather than the edges: a page number keeps it when it grows from "9" to "10"
+    center = (bbox[0] + bbox[2]) / 2
+    return (
+        digest,
+        round(bbox[1] / height / POSITION_QUANTUM),
+        round(bbox[3] / height / POSITION_QUANTUM),
+        round(center / width / POSITION_QUANTUM),
+    )
+
+
+def sample_pages(num_pages: int, head: int = REPEAT_SAMPLE_HEAD, spread: int = REPEAT_SAMPLE_SPREAD) -> list[int]:
+    """Page numbers (1-based, sorted) to look for repeated blocks in: the first head pages and spread more evenly spaced after them."""
+    rest = num_pages - head
+    if rest <= spread:
+        return list(range(1, num_pages + 1))
+    step = rest / spread
+    return list(range(1, head + 1)) + [head + 1 + int(step * i + step / 2) for i in range(spread)]
+
+
+def find_repeated(pages: dict, page_dims: dict) -> set:
+    """Signatures of the blocks repeated across pages, given the text blocks of every page as {page: blocks}."""
+    threshold = max(REPEAT_MIN_PAGES, REPEAT_MIN_FRACTION * len(pages))
+    if len(pages) < threshold:
+        return set()
+    counts = {}
+    for page_num, blocks in pages.items():
+        # A signature counts once per page
+        signatures = {block_signature(block, page_dims.get(page_num)) for block in blocks}
+        signatures.discard(None)
+        for signature in signatures:
+            counts[signature] = counts.get(signature, 0) + 1
+    return {signature for signature, count in counts.items() if count >= threshold}
+
+
+def drop_repeated(blocks: list[dict], repeated: set, page_size: tuple) -> list[dict]:
+    if not repeated:
+        return blocks
+    return [block for block in blocks if block_signature(block, page_size) not in repeated]
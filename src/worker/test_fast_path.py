@@ -0,0 +1,118 @@
+import pytest
+
+import fast_path
+from fast_path import classify_block, stands_alone
+
+PAGE = (612, 792)
+
+
+def block(content, bbox=(72, 300, 300, 312), page=3, column=0, bold=False, ratio=1.0):
+    return {
+        "content": content,
+        "bbox": list(bbox),
+        "page": page,
+        "column": column,
+        "font": {"size": 10 * ratio, "bold": bold, "ratio": ratio},
+    }
+
+
+def kinds(components):
+    return None if components is None else [comp["component"] for comp in components]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("12", []),
+    ("Page 3 of 10", []),
+    ("Figure 2: Results on the test set. Higher is better.", ["FigureTitle", "FigureCaption"]),
+    ("Table 1. Hyperparameters", ["FigureTitle"]),
+    ("3.2 Training Setup", ["Heading"]),
+    ("References", ["Heading"]),
+    ("[1] A. Author and B. Writer. A paper title. In Proc. X, 2020.", ["Text"]),
+    ("[1] A. Author. First paper, 2019. [2] B. Writer. Second paper, 2020.", ["Text", "Text"]),
+])
+def test_plain_blocks(text, expected):
+    assert kinds(classify_block(block(text, bold=True), PAGE)) == expected
+
+
+@pytest.mark.parametrize("text, is_reference", [
+    ("Smith, J., Doe, A., and Lee, K. Deep nets for parsing. NeurIPS, 2020.", True),
+    ("J. Smith, A. Doe, and K. Lee. Learning to parse. In ICML, 2019.", True),
+    ("Smith, J., et al. Scaling laws, revisited. arXiv, 2021.", True),
+    # Prose that starts with a name: one author and long clauses
+    ("Smith, J., as shown in prior work on this problem, found that the method fails in 2019, "
+     "which motivates the approach described in this section.", False),
+    # Math needs the LLM even when the block looks like a reference
+    ("Smith, J., Doe, A. where x = y^2, 2020.", False),
+])
+def test_references(text, is_reference):
+    components = classify_block(block(text), PAGE) or []
+    # Reference entries are paragraphs, prose is split into sentences
+    assert any(comp["props"].get("style") == "paragraph" for comp in components) == is_reference
+
+
+def test_reference_split_keeps_entries_verbatim():
+    text = "[1] A. Author. First paper, 2019. [2] B. Writer. Second paper, 2020."
+    entries = [comp["props"]["text"] for comp in classify_block(block(text), PAGE)]
+    assert entries == ["[1] A. Author. First paper, 2019.", "[2] B. Writer. Second paper, 2020."]
+
+
+@pytest.mark.parametrize("text, bold, ratio, neighbours, expected", [
+    # Bold line alone in its column with space above: a heading
+    ("Related Work", True, 1.0, [block("Body text.", bbox=(72, 260, 300, 286))], ["Heading"]),
+    # Larger than the body: a heading whatever its neighbours
+    ("Related Work", False, 1.2, [block("Model", bbox=(320, 300, 400, 312))], ["Heading"]),
+    # Bold table cell with another cell on its row
+    ("Model", True, 1.0, [block("Accuracy", bbox=(150, 300, 250, 312))], None),
+    # Bold line right under the previous one, as in a run of short lines
+    ("Training details", True, 1.0, [block("Some text", bbox=(72, 286, 300, 299))], None),
+    # Run-in labels of theorem-like environments and algorithms
+    ("Theorem 1", True, 1.0, [], None),
+    ("Proof", True, 1.0, [], None),
+    ("Algorithm 2 Beam search", True, 1.0, [], None),
+    ("Definition", True, 1.2, [], None),
+    # A colon marks a label followed by its content
+    ("Input: a graph", True, 1.0, [], None),
+    # Plain body-size line
+    ("Related Work", False, 1.0, [], None),
+])
+def test_unnumbered_headings(text, bold, ratio, neighbours, expected):
+    chunk = block(text, bold=bold, ratio=ratio)
+    assert kinds(classify_block(chunk, PAGE, [chunk] + neighbours)) == expected
+
+
+@pytest.mark.parametrize("neighbour, alone", [
+    (None, True),
+    (block("x", bbox=(150, 301, 250, 311)), False),  # same row, same column
+    (block("x", bbox=(320, 301, 500, 311), column=1), True),  # same row, other column
+    (block("x", bbox=(72, 250, 300, 280)), True),  # paragraph well above
+    (block("x", bbox=(72, 285, 300, 298)), False),  # line directly above
+])
+def test_stands_alone(neighbour, alone):
+    chunk = block("Heading")
+    assert stands_alone(chunk, [chunk] + ([neighbour] if neighbour else [])) == alone
+
+
+def test_prose_is_split_into_sentences():
+    text = ("The model is trained on a large corpus of documents. "
+            "It is then evaluated on three held-out benchmarks from prior work.")
+    assert kinds(classify_block(block(text), PAGE)) == ["Text", "Text"]
+
+
+@pytest.mark.parametrize("text, chunk_args", [
+    # Captions with math need LaTeX too
+    ("Figure 3: Loss for λ = 0.1 and x^2.", {}),
+    # Title, authors and abstract of the first page go to the LLM
+    ("The model is trained on a large corpus of documents. It is evaluated on three benchmarks.", {"page": 1}),
+    # Paragraphs with math need LaTeX
+    ("We minimize the loss L = sum of errors over the data. It is evaluated on three benchmarks.", {}),
+    # Near the top edge of the page: possibly a running header
+    ("The model is trained on a large corpus of documents. It is evaluated on three benchmarks.",
+     {"bbox": (72, 20, 540, 40)}),
+])
+def test_ambiguous_blocks_go_to_the_llm(text, chunk_args):
+    assert classify_block(block(text, **chunk_args), PAGE) is None
+
+
+def test_title_on_first_page():
+    chunk = block("Attention Is All You Need", page=1, ratio=fast_path.TITLE_MIN_RATIO, bbox=(72, 80, 540, 110))
+    assert kinds(classify_block(chunk, PAGE, [chunk])) == ["Title"]
@@ -0,0 +1,55 @@
+import pytest
+
+from json_stream import JSONArrayStream
+
+
+def feed_all(pieces):
+    stream = JSONArrayStream()
+    elements = []
+    for piece in pieces:
+        elements.extend(stream.feed(piece))
+    return stream, elements
+
+
+@pytest.mark.parametrize("pieces, expected", [
+    (['[{"a": 1}, {"b": 2}]'], [{"a": 1}, {"b": 2}]),
+    # Split anywhere, even inside strings and escapes
+    (['[{"a"', ': "x\\', '"y"}', ', {"b": [1, ', '2]}]'], [{"a": 'x"y'}, {"b": [1, 2]}]),
+    # Brackets inside strings do not close the element
+    (['[{"t": "a ] } [ {"}]'], [{"t": "a ] } [ {"}]),
+    # A fence before the array is skipped
+    (['```json\n[{"a": 1}]\n```'], [{"a": 1}]),
+    # Cut off mid-element: the complete elements are kept
+    (['[{"a": 1}, {"b": '], [{"a": 1}]),
+    # Nothing after the closing bracket is read
+    (['[{"a": 1}] [{"b": 2}]'], [{"a": 1}]),
+    ([''], []),
+])
+def test_elements(pieces, expected):
+    assert feed_all(pieces)[1] == expected
+
+
+def test_elements_are_returned_as_soon_as_they_close():
+    stream = JSONArrayStream()
+    assert stream.feed('[{"a": 1}') == [{"a": 1}]
+    assert stream.feed(', {"b"') == []
+    assert stream.pending == '{"b"'
+    assert stream.feed(': 2}]') == [{"b": 2}]
+    assert stream.closed
+
+
+@pytest.mark.parametrize("text, latex", [
+    # LaTeX written with single backslashes is not valid JSON
+    ('[{"latex": "\\alpha + \\sum_i x_i"}]', "\\alpha + \\sum_i x_i"),
+    ('[{"latex": "\\sqrt{a} \\cdot \\pi"}]', "\\sqrt{a} \\cdot \\pi"),
+])
+def test_stray_backslashes(text, latex):
+    stream, elements = feed_all([text])
+    assert elements == [{"latex": latex}]
+    assert stream.errors == 0
+
+
+def test_unparseable_elements_are_dropped_and_counted():
+    stream, elements = feed_all(['[{"a": 1,}, {"b": 2}]'])
+    assert elements == [{"b": 2}]
+    assert stream.errors == 1
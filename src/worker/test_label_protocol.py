@@ -0,0 +1,80 @@
+import pytest
+
+from label_protocol import split_sentences, split_lines, rebuild_components, offset_labels, last_labelled_line
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("One sentence.", ["One sentence."]),
+    ("First one. Second one!", ["First one.", "Second one!"]),
+    # Abbreviations and initials do not end a sentence
+    ("We follow Smith et al. in this work. It works.", ["We follow Smith et al. in this work.", "It works."]),
+    ("See Fig. 3 for details. Next sentence.", ["See Fig. 3 for details.", "Next sentence."]),
+    ("J. Smith wrote it. A. B. Jones too.", ["J. Smith wrote it.", "A. B. Jones too."]),
+    ("e.g. this one. And i.e. that.", ["e.g. this one.", "And i.e. that."]),
+    # Decimal points and lowercase continuations
+    ("Values are 3.5 and 4.2 here. Done.", ["Values are 3.5 and 4.2 here.", "Done."]),
+    ("It ends. then continues.", ["It ends. then continues."]),
+    # Closing quotes and brackets stay with their sentence
+    ('He said "stop." Then left.', ['He said "stop."', "Then left."]),
+    ("Line\nbreaks   collapse. Here.", ["Line breaks collapse.", "Here."]),
+    ("", []),
+])
+def test_split_sentences(text, expected):
+    assert split_sentences(text) == expected
+
+
+def lines_of(*chunks):
+    return split_lines([{"content": content, "bbox": [0, top, 100, top + 10]} for content, top in chunks])
+
+
+def kinds(components):
+    return [comp["component"] for comp in components]
+
+
+def image(number, y):
+    return number, {"filename": f"img{number}.png", "relative_position": {"x": 0.1, "y": y, "width": 0.5, "height": 0.1}}
+
+
+@pytest.mark.parametrize("labels, expected", [
+    # Unlabelled lines stay sentences
+    ([], [("Text", "Intro"), ("Text", "First point."), ("Text", "Second point.")]),
+    ([{"t": "h", "i": [0], "l": 2}], [("Heading", "Intro"), ("Text", "First point."), ("Text", "Second point.")]),
+    # A group is emitted once, at its first line
+    ([{"t": "list", "i": [1, 2]}], [("Text", "Intro"), ("List", None)]),
+    ([{"t": "drop", "i": [0]}], [("Text", "First point."), ("Text", "Second point.")]),
+    # A line claimed twice belongs to the first label
+    ([{"t": "quote", "i": [1]}, {"t": "h", "i": [1, 2]}],
+     [("Text", "Intro"), ("Blockquote", "First point."), ("Heading", "Second point.")]),
+    # Out of range and malformed line numbers are ignored
+    ([{"t": "h", "i": [7, "x"]}], [("Text", "Intro"), ("Text", "First point."), ("Text", "Second point.")]),
+    # A rewritten sentence keeps the model's text
+    ([{"t": "s", "i": [2], "text": "Second point with $x$."}],
+     [("Text", "Intro"), ("Text", "First point."), ("Text", "Second point with $x$.")]),
+])
+def test_rebuild_components(labels, expected):
+    lines = lines_of(("Intro", 100), ("First point. Second point.", 200))
+    components = rebuild_components(lines, labels, [], [])
+    assert [(comp["component"], comp["props"].get("text")) for comp in components] == expected
+
+
+@pytest.mark.parametrize("labels, expected", [
+    # After the line the model chose
+    ([{"o": "I1", "after": 0}], ["Text", "Image", "Text"]),
+    ([{"o": "I1", "after": -1}], ["Image", "Text", "Text"]),
+    # Otherwise after the last line that starts above it on the page
+    ([], ["Text", "Image", "Text"]),
+    # An unknown object is ignored and the image still placed once
+    ([{"o": "I9", "after": 0}, {"o": "I1", "after": 1}, {"o": "I1", "after": 0}], ["Text", "Text", "Image"]),
+])
+def test_objects_are_placed_once(labels, expected):
+    lines = lines_of(("Above the figure.", 100), ("Below the figure.", 500))
+    assert kinds(rebuild_components(lines, labels, [image(1, 0.3)], [], (612, 792))) == expected
+
+
+def test_continuation_labels_are_renumbered():
+    labels = [{"t": "h", "i": [0, 1]}, {"o": "T2", "after": 1}]
+    shifted = offset_labels(labels, 5)
+    assert shifted == [{"t": "h", "i": [5, 6]}, {"o": "T2", "after": 6}]
+    assert labels[0]["i"] == [0, 1]  # the input is left alone
+    assert last_labelled_line(shifted) == 6
+    assert last_labelled_line([]) == -1
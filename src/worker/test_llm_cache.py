@@ -0,0 +1,58 @@
+import pytest
+
+from llm_cache import LLMCache
+
+SYSTEM = "You convert PDF text to components."
+PROMPT = "Text: Hello world."
+PARAMS = {"model": "deepseek-chat", "temperature": 0.1, "max_tokens": 2000}
+
+
+@pytest.mark.parametrize("other", [
+    (SYSTEM + " ", PROMPT, PARAMS),
+    (SYSTEM, PROMPT + ".", PARAMS),
+    (SYSTEM, PROMPT, {**PARAMS, "model": "deepseek-reasoner"}),
+    (SYSTEM, PROMPT, {**PARAMS, "temperature": 0.2}),
+    (SYSTEM, PROMPT, {**PARAMS, "max_tokens": 4000}),
+    (SYSTEM, PROMPT, {**PARAMS, "stream": True}),
+    # The parts of the request do not run into each other
+    (SYSTEM + PROMPT, "", PARAMS),
+])
+def test_key_changes_with_any_part_of_the_request(other):
+    assert LLMCache.key(*other) != LLMCache.key(SYSTEM, PROMPT, PARAMS)
+
+
+def test_key_ignores_parameter_order():
+    reordered = dict(reversed(list(PARAMS.items())))
+    assert LLMCache.key(SYSTEM, PROMPT, reordered) == LLMCache.key(SYSTEM, PROMPT, PARAMS)
+
+
+def test_round_trip(tmp_path):
+    cache = LLMCache(str(tmp_path / "cache.sqlite3"))
+    key = cache.key(SYSTEM, PROMPT, PARAMS)
+    assert cache.get(key) is None
+    value = {"content": "[{\"component\": \"Text\"}]", "finish_reason": "stop", "usage": {"total_tokens": 12}}
+    cache.put(key, value)
+    assert cache.get(key) == value
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_disabled(tmp_path):
+    cache = LLMCache(str(tmp_path / "cache.sqlite3"), enabled=False)
+    cache.put("k", {"content": "x"})
+    assert cache.get("k") is None
+    assert not (tmp_path / "cache.sqlite3").exists()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("llm_cache.time.time", lambda: now[0])
+    value = {"content": "x" * 100}
+    cache = LLMCache(str(tmp_path / "cache.sqlite3"), max_bytes=400)
+    for key in ("a", "b", "c"):
+        now[0] += 1
+        cache.put(key, value)
+    now[0] += 1
+    cache.get("a")  # "b" is now the least recently used
+    now[0] += 1
+    cache.put("d", value)
+    assert [key for key in "abcd" if cache.get(key)] == ["a", "c", "d"]
@@ -0,0 +1,162 @@
+import asyncio
+
+import pytest
+
+import llm_dispatch
+from llm_dispatch import Dispatcher, TokenBucket, set_job, set_priority
+from llm_limiter import AdaptiveLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llm_dispatch.time, "monotonic", clock)
+    return clock
+
+
+@pytest.mark.parametrize("per_minute, taken, elapsed, amount, wait", [
+    (60, 0, 0, 1, 0.0),
+    (60, 60, 0, 1, 1.0),  # one token per second
+    (60, 60, 0.5, 1, 0.5),
+    (60, 60, 120, 60, 0.0),  # refills up to a minute's worth
+    (60, 60, 120, 61, 0.0),  # more than the bucket holds only waits for a full bucket
+    (60, 30, 0, 90, 30.0),
+    (0, 10**6, 0, 10**6, 0.0),  # 0 is unlimited
+])
+def test_token_bucket_wait_time(clock, per_minute, taken, elapsed, amount, wait):
+    bucket = TokenBucket(per_minute)
+    bucket.take(taken)
+    clock.now += elapsed
+    assert bucket.wait_time(amount) == pytest.approx(wait)
+
+
+def test_token_bucket_refund_is_capped(clock):
+    bucket = TokenBucket(60)
+    bucket.take(10)
+    bucket.refund(50)
+    assert bucket.tokens == 60
+
+
+def run_jobs(dispatcher, requests):
+    """Run (job, priority) requests queued in that order, returning the order they were let through."""
+    served = []
+
+    async def request(job, priority, index):
+        set_job(job)
+        set_priority(priority)
+        async with dispatcher.slot():
+            served.append(index)
+            await asyncio.sleep(0)
+
+    async def main():
+        tasks = [asyncio.ensure_future(request(job, priority, i)) for i, (job, priority) in enumerate(requests)]
+        await asyncio.gather(*tasks)
+    asyncio.run(main())
+    return served
+
+
+@pytest.mark.parametrize("requests, expected", [
+    # One job: by priority, then in arrival order
+    ([("a", 3), ("a", 1), ("a", 2), ("a", 1)], [0, 1, 3, 2]),
+    # A job with many requests does not hold back one with few
+    ([("a", 0), ("a", 0), ("a", 0), ("b", 0), ("b", 0)], [0, 1, 3, 2, 4]),
+    ([("a", 0), ("a", 0), ("b", 0), ("c", 0), ("a", 0)], [0, 1, 2, 3, 4]),
+    # Priority orders a job's own requests, not the jobs
+    ([("a", 5), ("a", 5), ("b", 9), ("b", 1)], [0, 1, 3, 2]),
+])
+def test_round_robin_between_jobs(requests, expected):
+    dispatcher = Dispatcher(AdaptiveLimiter(initial=1, maximum=1), rpm=0, tpm=0)
+    assert run_jobs(dispatcher, requests) == expected
+
+
+def test_cancelled_request_gives_its_place_back():
+    dispatcher = Dispatcher(AdaptiveLimiter(initial=1, maximum=1), rpm=0, tpm=0)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def hold():
+            async with dispatcher.slot():
+                await release.wait()
+
+        async def quick():
+            async with dispatcher.slot():
+                pass
+
+        holder = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        waiting = asyncio.ensure_future(quick())
+        await asyncio.sleep(0)
+        assert dispatcher.queue_depth == 1
+        waiting.cancel()
+        release.set()
+        await holder
+        await asyncio.wait_for(quick(), 1)
+        return dispatcher.limiter.in_flight, dispatcher._granted
+    assert asyncio.run(main()) == (0, 0)
+
+
+class Budget:
+    """Shared budget that makes the first takes wait, in window 7."""
+    def __init__(self, waits):
+        self.waits = list(waits)
+        self.taken = 0
+        self.refunds = []
+
+    def take(self, tokens):
+        self.taken += tokens
+        return (self.waits.pop(0) if self.waits else 0), 7
+
+    def refund(self, tokens, window):
+        self.refunds.append((tokens, window))
+
+
+def test_shared_budget_replaces_the_local_buckets():
+    dispatcher = Dispatcher(AdaptiveLimiter(initial=2), rpm=1, tpm=1)
+    budget = Budget([0.01, 0])
+    dispatcher.use_shared_budget(budget)
+
+    async def main():
+        async with dispatcher.slot(100) as window:
+            # Refunded to the window the slot took the tokens from
+            dispatcher.refund(40)
+        dispatcher.refund(10, window)
+        await asyncio.sleep(0.05)
+        return window
+    assert asyncio.run(main()) == 7
+    assert dispatcher.requests.unlimited and dispatcher.tokens.unlimited
+    assert (budget.taken, budget.refunds, dispatcher._granted) == (200, [(40, 7), (10, 7)], 0)
+
+
+class Redis:
+    def __init__(self):
+        self.calls = []
+
+    def eval(self, script, keys, args):
+        self.calls.append((keys, args[0]))
+        return 1
+
+
+@pytest.mark.parametrize("taken_at, refunded_at, refunded", [
+    (30.0, 50.0, True),
+    # The window is over: its tokens are not handed to the next one
+    (59.0, 61.0, False),
+    (30.0, 150.0, False),
+])
+def test_shared_refund_goes_to_the_window_of_the_reservation(monkeypatch, taken_at, refunded_at, refunded):
+    now = [taken_at]
+    monkeypatch.setattr(llm_dispatch.time, "time", lambda: now[0])
+    redis = Redis()
+    budget = llm_dispatch.SharedBudget(redis, rpm=10, tpm=1000, prefix="b")
+    assert budget.take(100) == (0.0, 0)
+    now[0] = refunded_at
+    budget.refund(60, 0)
+    assert redis.calls[1:] == ([(["b:tokens:0"], 60)] if refunded else [])
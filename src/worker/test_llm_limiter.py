@@ -0,0 +1,108 @@
+import asyncio
+
+import httpx
+import pytest
+
+import llm_limiter
+from llm_limiter import AdaptiveLimiter, DeadlineExceeded, is_overload
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_limiter.time, "monotonic", lambda: now[0])
+    return now
+
+
+def status_error(status):
+    request = httpx.Request("POST", "https://llm.example/v1/chat/completions")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status, request=request))
+
+
+@pytest.mark.parametrize("exc, overload", [
+    (status_error(429), True),
+    (status_error(500), True),
+    (status_error(503), True),
+    (status_error(400), False),
+    (status_error(401), False),
+    (httpx.ReadTimeout("slow"), True),
+    (asyncio.TimeoutError(), True),
+    # A job running out of its own time says nothing about the provider
+    (DeadlineExceeded("job deadline passed"), False),
+    (httpx.ConnectError("refused"), False),
+    (ValueError("bad answer"), False),
+])
+def test_is_overload(exc, overload):
+    assert is_overload(exc) == overload
+
+
+def finish(limiter, latency=None, overloaded=False):
+    limiter.in_flight += 1
+    limiter.release(latency=latency, overloaded=overloaded)
+
+
+@pytest.mark.parametrize("initial, successes, expected", [
+    # About one more slot after every `limit` successes
+    (4, 1, 4),
+    (4, 6, 5),
+    (4, 11, 6),
+    (1, 1, 1),  # the first request only sets the latency baseline
+    (1, 2, 2),
+    (31, 200, 32),  # capped at the maximum
+])
+def test_additive_increase(clock, initial, successes, expected):
+    limiter = AdaptiveLimiter(initial=initial, minimum=1, maximum=32)
+    for _ in range(successes):
+        finish(limiter, latency=1.0)
+    assert limiter.limit == expected
+
+
+@pytest.mark.parametrize("initial, overloads, spacing, expected", [
+    (16, 1, 0, 8),
+    # Requests already in flight report the same overload: counted once per baseline latency
+    (16, 3, 0, 8),
+    (16, 3, 2.0, 2),
+    (2, 5, 2.0, 1),  # never below the minimum
+])
+def test_multiplicative_decrease(clock, initial, overloads, spacing, expected):
+    limiter = AdaptiveLimiter(initial=initial, minimum=1, maximum=32)
+    finish(limiter, latency=1.0)
+    for _ in range(overloads):
+        clock[0] += spacing
+        finish(limiter, overloaded=True)
+    assert limiter.limit == expected
+
+
+def test_latency_spike_shrinks_the_limit(clock):
+    limiter = AdaptiveLimiter(initial=10, minimum=1, maximum=32)
+    finish(limiter, latency=1.0)
+    clock[0] += 5
+    finish(limiter, latency=llm_limiter.LATENCY_FACTOR * 1.5)
+    assert limiter.limit == 9
+
+
+def test_waiters_are_served_in_order():
+    limiter = AdaptiveLimiter(initial=1, minimum=1, maximum=1)
+    served = []
+
+    async def request(index):
+        async with limiter.slot():
+            served.append(index)
+            await asyncio.sleep(0)
+
+    async def main():
+        await asyncio.gather(*(request(i) for i in range(5)))
+        return limiter.in_flight
+    assert asyncio.run(main()) == 0
+    assert served == [0, 1, 2, 3, 4]
+
+
+def test_failed_request_releases_its_slot(clock):
+    limiter = AdaptiveLimiter(initial=4, minimum=1, maximum=8)
+
+    async def main():
+        with pytest.raises(httpx.HTTPStatusError):
+            async with limiter.slot():
+                raise status_error(429)
+    asyncio.run(main())
+    assert (limiter.in_flight, limiter.limit) == (0, 2)
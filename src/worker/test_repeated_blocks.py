@@ -0,0 +1,89 @@
+import pytest
+
+from repeated_blocks import normalize, block_signature, find_repeated, drop_repeated, sample_pages
+
+PAGE = (612, 792)
+
+
+def text_block(content, bbox):
+    return {"content": content, "bbox": list(bbox)}
+
+
+def header(page):
+    return text_block("Proceedings of the Conference 2024", (200, 20, 412, 32))
+
+
+def page_number(page):
+    # Grows from "9" to "10": the center stays put, the right edge moves
+    width = 6 * len(str(page))
+    return text_block(str(page), (306 - width / 2, 760, 306 + width / 2, 772))
+
+
+def body(page):
+    return text_block(f"Paragraph {page} discusses a different topic with different words in it every time.",
+                      (72, 100 + page, 540, 160 + page))
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Page 3", "page #"),
+    ("  Page\n12  ", "page #"),
+    ("12 Methods", "# methods"),
+    # Longer blocks keep their numbers: they must repeat verbatim
+    ("In 2019 we ran 3 experiments on the new data", "in 2019 we ran 3 experiments on the new data"),
+])
+def test_normalize(text, expected):
+    assert normalize(text) == expected
+
+
+@pytest.mark.parametrize("a, b, same", [
+    (text_block("Page 3", (300, 760, 330, 772)), text_block("Page 4", (300, 760, 330, 772)), True),
+    (text_block("Page 3", (300, 760, 330, 772)), text_block("Page 4", (300.5, 760.5, 330.5, 772.5)), True),
+    (text_block("Page 3", (300, 760, 330, 772)), text_block("Page 3", (300, 400, 330, 412)), False),
+    (text_block("Header", (300, 20, 330, 32)), text_block("Footer", (300, 20, 330, 32)), False),
+])
+def test_signature(a, b, same):
+    assert (block_signature(a, PAGE) == block_signature(b, PAGE)) == same
+
+
+@pytest.mark.parametrize("block, page_size", [
+    ({"content": "No position"}, PAGE),
+    (text_block("   ", (0, 0, 10, 10)), PAGE),
+    (text_block("No page size", (0, 0, 10, 10)), None),
+])
+def test_no_signature(block, page_size):
+    assert block_signature(block, page_size) is None
+
+
+def test_headers_and_page_numbers_are_dropped():
+    pages = {n: [header(n), body(n), page_number(n)] for n in range(1, 11)}
+    dims = {n: PAGE for n in pages}
+    repeated = find_repeated(pages, dims)
+    assert len(repeated) == 2
+    kept = drop_repeated(pages[10], repeated, PAGE)
+    assert kept == [body(10)]
+
+
+@pytest.mark.parametrize("pages_with_header, n_pages, found", [
+    (range(1, 11, 2), 10, True),  # alternating left and right pages: 40%
+    (range(1, 4), 10, False),  # a few pages only
+    (range(1, 3), 2, False),  # too short a document
+])
+def test_threshold(pages_with_header, n_pages, found):
+    pages = {n: [body(n)] + ([header(n)] if n in pages_with_header else []) for n in range(1, n_pages + 1)}
+    assert bool(find_repeated(pages, {n: PAGE for n in pages})) == found
+
+
+def test_a_signature_counts_once_per_page():
+    pages = {n: [header(n), header(n), header(n)] if n == 1 else [body(n)] for n in range(1, 6)}
+    assert find_repeated(pages, {n: PAGE for n in pages}) == set()
+
+
+@pytest.mark.parametrize("num_pages, head, spread, expected", [
+    (1, 6, 4, [1]),
+    (6, 6, 4, [1, 2, 3, 4, 5, 6]),
+    (8, 6, 4, [1, 2, 3, 4, 5, 6, 7, 8]),
+    (100, 6, 4, [1, 2, 3, 4, 5, 6, 18, 42, 65, 89]),
+    (1000, 2, 2, [1, 2, 252, 751]),
+])
+def test_sample_pages(num_pages, head, spread, expected):
+    assert sample_pages(num_pages, head, spread) == expected
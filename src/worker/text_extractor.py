@@ -1,7 +1,108 @@
-import fitz  # PyMuPDF
+import os
+import multiprocessing as mp
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
 from base_extractor import BaseExtractor
+from document_context import DocumentContext
 from operator import itemgetter
 
+# Worker processes for whole-document text extraction, by default this worker's share of the cores.
+# worker_pool sets PDF_WORKER_PROCESSES in each worker; a worker run on its own is alone (as in llm_dispatch)
+TEXT_PROCESSES = int(os.environ.get(
+    "PDF_TEXT_PROCESSES",
+    max(1, (os.cpu_count() or 1) // max(1, int(os.environ.get("PDF_WORKER_PROCESSES", 1))))
+))
+# Below this many pages starting the processes costs more than it saves
+PARALLEL_MIN_PAGES = 16
+
+# Arrow symbols and author-block markers (†, ‡, *) left in the text by PDF formatting
+ARTIFACTS = str.maketrans("", "", "⇤⇥←→†‡*")
+
+
+# span["flags"] bits, see PyMuPDF's TEXT_FONT_* constants
+FONT_ITALIC = 2
+FONT_BOLD = 16
+# Font sizes are compared in steps of half a point
+SIZE_STEP = 0.5
+
+
+def clean_line(text: str) -> str:
+    """Line text without formatting artifacts and with runs of whitespace collapsed."""
+    return " ".join(text.translate(ARTIFACTS).split())
+
+
+def body_font_size(blocks: list[dict]) -> float | None:
+    """Font size of most of the text (weighted by characters) among the given blocks."""
+    sizes = Counter()
+    for block in blocks:
+        font = block.get("font")
+        if font and font.get("size"):
+            sizes[font["size"]] += len(block["content"])
+    return sizes.most_common(1)[0][0] if sizes else None
+
+
+def set_size_ratios(blocks: list[dict], body: float = None):
+    """
+    Set font["ratio"], the block's font size relative to the body text: body,
+    the body size of the whole document, or else that of the given blocks.
+    extract_page can only compare with the rest of its page.
+    """
+    body = body or body_font_size(blocks)
+    if not body:
+        return
+    for block in blocks:
+        font = block.get("font")
+        if font and font.get("size"):
+            font["ratio"] = round(font["size"] / body, 2)
+
+
+def _column(bbox, page_width: float) -> int | None:
+    """0 or 1 for a block within the left or right half of the page, None for one spanning both."""
+    middle = page_width / 2
+    margin = page_width * 0.02
+    if bbox[2] <= middle + margin:
+        return 0
+    if bbox[0] >= middle - margin:
+        return 1
+    return None
+
+
+def _typography(spans: list[dict]) -> dict | None:
+    """Dominant font size, and whether most characters are bold / italic, of a block's spans."""
+    sizes = Counter()
+    chars = bold = italic = 0
+    for span in spans:
+        n = len(span.get("text", "").strip())
+        if not n:
+            continue
+        flags = span.get("flags", 0)
+        sizes[round(span.get("size", 0) / SIZE_STEP) * SIZE_STEP] += n
+        chars += n
+        if flags & FONT_BOLD or "bold" in span.get("font", "").lower():
+            bold += n
+        if flags & FONT_ITALIC or "italic" in span.get("font", "").lower():
+            italic += n
+    if not chars:
+        return None
+    return {
+        "size": sizes.most_common(1)[0][0],
+        "bold": bold * 2 > chars,
+        "italic": italic * 2 > chars,
+    }
+
+
+def _extract_range(pdf_path: str, page_numbers: list[int]) -> list[list[dict]]:
+    """Worker process: text blocks of some pages, read through a fitz handle of its own."""
+    extractor = TextExtractor()
+    with DocumentContext(pdf_path) as doc:
+        results = []
+        for page_number in page_numbers:
+            results.append(extractor.extract_page(doc, page_number))
+            doc.page(page_number).release()
+        return results
+
+
 class TextExtractor(BaseExtractor):
     """
     Extracts text from a PDF, preserving the block structure.
@@ -9,48 +110,106 @@ class TextExtractor(BaseExtractor):
     maintains the document's original layout (headings, paragraphs, etc.),
     giving the LLM the necessary context for proper formatting.
     """
-    def extract(self, pdf_path: str) -> list[dict]:
-        doc = fitz.open(pdf_path)
+    def __init__(self):
+        self._pool = None
+        self._pool_size = 0
+
+    def _executor(self, processes: int) -> ProcessPoolExecutor:
+        """Text extraction processes, started on first use and kept for the following documents."""
+        if self._pool is None or self._pool_size < processes:
+            self.close()
+            # spawn, like worker_pool: the worker may hold threads and connections that must not be forked
+            self._pool = ProcessPoolExecutor(max_workers=processes, mp_context=mp.get_context("spawn"))
+            self._pool_size = processes
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+            self._pool_size = 0
+
+    def extract_page(self, doc: DocumentContext, page_number: int) -> list[dict]:
+        page = doc.page(page_number)
+        page_num = page.number
         blocks = []
-        for page_num, page in enumerate(doc, 1):
-            # Extract text blocks from the page as a dictionary
-            page_blocks = page.get_text("dict")["blocks"]
-            for block in page_blocks:
-                # only text blocks - type 0
-                if block.get("type", 1) != 0:
-                    continue
-
-                # Reconstruct the text content of the block
-                block_text = ""
-                lines = []
-                for line in block.get("lines", []):
-                    # Join spans within a line with a space
-                    line_text = " ".join([span.get("text", "") for span in line.get("spans", [])])
-                    if line_text.strip():  # Only add non-empty lines
-                        # Clean up common PDF artifacts
-                        cleaned_line = line_text.strip()
-                        # Remove arrow symbols and other formatting artifacts
-                        cleaned_line = cleaned_line.replace('⇤', '').replace('⇥', '').replace('←', '').replace('→', '')
-                        # Remove other common symbols that might appear in author blocks
-                        cleaned_line = cleaned_line.replace('†', '').replace('‡', '').replace('*', '')
-                        # Remove multiple spaces
-                        cleaned_line = ' '.join(cleaned_line.split())
-                        if cleaned_line:
-                            lines.append(cleaned_line)
-                
-                # Join lines with newlines to preserve structure
-                block_text = "\n".join(lines)
-
-                # Skip empty blocks
-                if not block_text.strip():
-                    continue
-
-                blocks.append({
-                    "id": f"{page_num}-{block['number']}",
-                    "type": "text",
-                    "content": block_text.strip(),
-                    "bbox": list(block["bbox"]),
-                    "page": page_num,
-                })
-        doc.close()
-        return blocks
\ No newline at end of file
+        # Text blocks of the page, parsed once per job by the shared PageContext
+        page_blocks = page.text_dict["blocks"]
+        for block in page_blocks:
+            # only text blocks - type 0
+            if block.get("type", 1) != 0:
+                continue
+
+            # Reconstruct the text content of the block
+            block_text = ""
+            lines = []
+            spans = []
+            for line in block.get("lines", []):
+                spans.extend(line.get("spans", []))
+                # Join spans within a line with a space
+                line_text = " ".join([span.get("text", "") for span in line.get("spans", [])])
+                # Clean up common PDF artifacts, dropping lines left empty
+                cleaned_line = clean_line(line_text)
+                if cleaned_line:
+                    lines.append(cleaned_line)
+            
+            # Join lines with newlines to preserve structure
+            block_text = "\n".join(lines)
+
+            # Skip empty blocks
+            if not block_text.strip():
+                continue
+
+            blocks.append({
+                "id": f"{page_num}-{block['number']}",
+                "type": "text",
+                "content": block_text.strip(),
+                "bbox": list(block["bbox"]),
+                "page": page_num,
+                # Layout hints for the fast path: font["ratio"] is the size relative to the body text
+                "font": _typography(spans),
+                "column": _column(block["bbox"], page.width),
+            })
+        # Until set_size_ratios sees the whole document, sizes are compared with this page's body text
+        set_size_ratios(blocks)
+        return blocks
+
+    def extract(self, source: DocumentContext | str) -> list[dict]:
+        blocks = super().extract(source)
+        set_size_ratios(blocks)
+        return blocks
+
+    def extract_iter(self, source: DocumentContext | str, processes: int = TEXT_PROCESSES):
+        """
+        Like BaseExtractor.extract_iter. Long documents are read by several
+        processes, and their pages are yielded in order as each range completes.
+        """
+        with self.open_document(source) as doc:
+            page_numbers = list(range(1, len(doc) + 1))
+            if processes > 1 and len(page_numbers) >= PARALLEL_MIN_PAGES:
+                yield from self.iter_pages(doc.path, page_numbers, processes)
+            else:
+                # doc rather than source: a path is not opened a second time. Pages are released
+                # as they are yielded only if the document was opened here
+                yield from self._iter_open(doc, owned=doc is not source)
+
+    def extract_pages(self, pdf_path: str, page_numbers: list[int], processes: int = TEXT_PROCESSES) -> dict:
+        """Text blocks of the given pages as {page: blocks}, see iter_pages."""
+        return dict(self.iter_pages(pdf_path, page_numbers, processes))
+
+    def iter_pages(self, pdf_path: str, page_numbers: list[int], processes: int = TEXT_PROCESSES):
+        """
+        Yield (page number, text blocks) of the given pages in order. The pages
+        are split into contiguous ranges, one per worker process, each of which
+        opens the PDF with its own fitz handle (fitz documents cannot be shared).
+        """
+        page_numbers = list(page_numbers)
+        processes = max(1, min(processes, len(page_numbers)))
+        if processes == 1:
+            yield from zip(page_numbers, _extract_range(pdf_path, page_numbers))
+            return
+        size = -(-len(page_numbers) // processes)
+        ranges = [page_numbers[i:i + size] for i in range(0, len(page_numbers), size)]
+        pool = self._executor(processes)
+        for numbers, range_blocks in zip(ranges, pool.map(_extract_range, [pdf_path] * len(ranges), ranges)):
+            yield from zip(numbers, range_blocks)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Supervisor that runs several pdf_worker processes against the shared pdf_jobs queue.
+
+Each child imports pdf_worker itself, so models, DB connections and the Redis
+client are created once per process. Children that crash or exit because they
+went over their memory limit are started again.
+"""
+
+import os
+import sys
+import time
+import signal
+import argparse
+import threading
+import multiprocessing as mp
+
+POLL_INTERVAL = 1.0  # seconds between supervisor health checks
+RESTART_BACKOFF = 10.0  # delay before restarting a worker that died right after starting
+SHUTDOWN_TIMEOUT = float(os.environ.get("WORKER_SHUTDOWN_TIMEOUT", 300))
+
+
+def rss_mb(pid: int = None) -> float | None:
+    """Resident memory of a process in MB (current process by default), None if unknown."""
+    pid = pid or os.getpid()
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+    if pid != os.getpid():
+        return None
+    # No procfs (macOS): fall back to the peak RSS of this process
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _run_worker(index: int, max_rss_mb: float | None, threads: int | None, processes: int = 1):
+    """Entry point of a child process."""
+    # Per-process shares (LLM rate budget, text extraction processes) are derived from the pool size
+    os.environ["PDF_WORKER_PROCESSES"] = str(processes)
+    if threads:
+        # Keep N workers from each spinning up one BLAS/torch thread per core
+        for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+            os.environ.setdefault(var, str(threads))
+
+    stop_event = threading.Event()
+    # Finish the current job on SIGTERM; Ctrl-C is handled by the supervisor
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    import pdf_worker
+    print(f"[worker {index}] started (pid {os.getpid()})")
+    pdf_worker.main(max_rss_mb=max_rss_mb, stop_event=stop_event)
+
+
+class WorkerPool:
+    def __init__(self, processes: int, max_rss_mb: float = None, hard_rss_mb: float = None):
+        self.processes = processes
+        self.max_rss_mb = max_rss_mb
+        self.hard_rss_mb = hard_rss_mb
+        self.threads = max(1, (os.cpu_count() or 1) // processes)
+        # spawn (not fork) so no DB/Redis connection or model state is shared
+        self._ctx = mp.get_context("spawn")
+        self._workers = {}
+        self._started_at = {}
+        self._next_start = {}
+        self._stopping = False
+
+    def _spawn(self, index: int):
+        process = self._ctx.Process(
+            target=_run_worker,
+            args=(index, self.max_rss_mb, self.threads, self.processes),
+            name=f"pdf-worker-{index}",
+        )
+        process.start()
+        self._workers[index] = process
+        self._started_at[index] = time.monotonic()
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for index, process in list(self._workers.items()):
+            if process is None:
+                if now >= self._next_start.get(index, 0):
+                    self._spawn(index)
+                continue
+
+            if not process.is_alive():
+                process.join()
+                print(f"[pool] worker {index} (pid {process.pid}) exited with code {process.exitcode}")
+                self._workers[index] = None
+                # Back off if the worker keeps dying during startup
+                if now - self._started_at[index] < RESTART_BACKOFF:
+                    self._next_start[index] = now + RESTART_BACKOFF
+                continue
+
+            if self.hard_rss_mb:
+                rss = rss_mb(process.pid)
+                if rss is not None and rss > self.hard_rss_mb:
+                    print(f"[pool] worker {index} (pid {process.pid}) uses {rss:.0f} MB > {self.hard_rss_mb:.0f} MB, killing")
+                    process.kill()
+
+    def _request_stop(self, *_):
+        self._stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+
+        print(f"[pool] starting {self.processes} workers ({self.threads} threads each)")
+        for index in range(self.processes):
+            self._spawn(index)
+
+        try:
+            while not self._stopping:
+                self._check_workers()
+                time.sleep(POLL_INTERVAL)
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        print("[pool] shutting down, waiting for running jobs to finish...")
+        running = [p for p in self._workers.values() if p is not None and p.is_alive()]
+        for process in running:
+            process.terminate()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for process in running:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                print(f"[pool] worker pid {process.pid} did not stop in time, killing")
+                process.kill()
+                process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a pool of PDF worker processes")
+    parser.add_argument(
+        "--workers", type=int,
+        default=int(os.environ.get("PDF_WORKER_PROCESSES", os.cpu_count() or 1)),
+        help="number of worker processes (default: PDF_WORKER_PROCESSES or CPU count)",
+    )
+    parser.add_argument(
+        "--max-rss-mb", type=float,
+        default=float(os.environ["WORKER_MAX_RSS_MB"]) if os.environ.get("WORKER_MAX_RSS_MB") else None,
+        help="workers exit between jobs and get restarted above this RSS",
+    )
+    parser.add_argument(
+        "--hard-rss-mb", type=float,
+        default=float(os.environ["WORKER_HARD_RSS_MB"]) if os.environ.get("WORKER_HARD_RSS_MB") else None,
+        help="workers are killed immediately above this RSS",
+    )
+    args = parser.parse_args()
+
+    hard_rss_mb = args.hard_rss_mb
+    if hard_rss_mb is None and args.max_rss_mb:
+        hard_rss_mb = args.max_rss_mb * 2
+
+    WorkerPool(max(1, args.workers), args.max_rss_mb, hard_rss_mb).run()
+
+
+if __name__ == "__main__":
+    main()